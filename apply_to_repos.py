@@ -1,35 +1,134 @@
 #!/usr/bin/env python3
 
 import argparse
+import fnmatch
+import json
 import subprocess
 import os
 import sys
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+from git_state import GitState, query_git_state, query_git_states
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+# The template tool is used as a library, so that it does not need to be started for every project
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "src"))
+import api
+import utils
+from apply import confirm_changes
+
 CONFIRM_ACTIONS = True
 CONFIG_FILE_NAME = "react-template.yaml"
+# Folders that never contain projects, but may contain a lot of files
+DEFAULT_IGNORE_PATTERNS = [".git", ".hg", ".svn", "node_modules", "build", "dist",
+                           "__pycache__", ".mypy_cache", ".cache", ".venv", "venv"]
+# @SYNC with: src/utils.py CACHE_DIR
+DISCOVERY_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "react-template", "discovery.json")
+
+# Result states of a repository in parallel mode
+SKIPPED = "skipped"
+UP_TO_DATE = "up to date"
+CHANGES = "changes"
+UPDATED = "updated"
+FAILED = "failed"
+
+
+class RepoResult(NamedTuple):
+    repo: str
+    status: str
+    details: str = ""
+
+
+def search_for_configs(path: str, ignore_patterns: List[str] = DEFAULT_IGNORE_PATTERNS, max_depth: int = -1,
+                       use_cache: bool = False) -> List[str]:
+    # Folders matching one of the ignore patterns are not searched.
+    # A negative max_depth means unlimited, 0 only checks the given folder
+    cache_key = json.dumps([os.path.realpath(path), sorted(ignore_patterns), max_depth])
+    if use_cache:
+        cached_projects = load_cached_discovery(cache_key)
+        if cached_projects is not None:
+            print("[INFO] No folder changed since the last search, using the cached project list")
+            return cached_projects
 
-def search_for_configs(path: str) -> List[str]:
-    project_dirs = []
-    for root, _dirs, files in os.walk(path):
-        if CONFIG_FILE_NAME in files:
-            # If the folder contains a config file, it is one of the projects
-            if os.path.realpath(root) != os.path.realpath(SCRIPT_DIR):
-                # Do not interpret this as one of the projects
-                project_dirs.append(root)
+    project_dirs: List[str] = []
+    visited_dirs: Dict[str, int] = {}
+    scan_for_configs(path, ignore_patterns, max_depth, project_dirs, visited_dirs)
+
+    if use_cache:
+        store_cached_discovery(cache_key, project_dirs, visited_dirs)
     return project_dirs
 
+
+def scan_for_configs(path: str, ignore_patterns: List[str], remaining_depth: int,
+                     project_dirs: List[str], visited_dirs: Dict[str, int]):
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        visited_dirs[path] = os.stat(path).st_mtime_ns
+    except OSError as e:
+        print(f"[WARN] Can not search '{path}': {e}")
+        return
+
+    file_names = [entry.name for entry in entries if entry.is_file()]
+    if CONFIG_FILE_NAME in file_names:
+        # If the folder contains a config file, it is one of the projects
+        if os.path.realpath(path) != os.path.realpath(SCRIPT_DIR):
+            # Do not interpret this as one of the projects
+            project_dirs.append(path)
+            # Projects are not nested, so their subfolders do not need to be searched
+            return
+
+    if remaining_depth == 0:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False) and not is_ignored(entry.name, ignore_patterns):
+            scan_for_configs(entry.path, ignore_patterns, remaining_depth - 1, project_dirs, visited_dirs)
+
+
+def is_ignored(dir_name: str, ignore_patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(dir_name, pattern) for pattern in ignore_patterns)
+
+
+def load_cached_discovery(cache_key: str) -> Optional[List[str]]:
+    # The cache is valid, if no searched folder was modified (a file added, removed or renamed)
+    try:
+        with open(DISCOVERY_CACHE_PATH, "rb") as f:
+            cache = json.loads(f.read().decode("utf-8"))
+        entry = cache[cache_key]
+        for dir_path, mtime_ns in entry["visited_dirs"].items():
+            if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                return None
+        return entry["projects"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_cached_discovery(cache_key: str, project_dirs: List[str], visited_dirs: Dict[str, int]):
+    try:
+        with open(DISCOVERY_CACHE_PATH, "rb") as f:
+            cache = json.loads(f.read().decode("utf-8"))
+    except (OSError, ValueError):
+        cache = {}
+    cache[cache_key] = {
+        "projects": project_dirs,
+        "visited_dirs": visited_dirs,
+    }
+    os.makedirs(os.path.dirname(DISCOVERY_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{DISCOVERY_CACHE_PATH}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps(cache).encode("utf-8"))
+    os.replace(tmp_path, DISCOVERY_CACHE_PATH)
+
 def cd(path = ""):
     os.chdir(SCRIPT_DIR) # to allow relative paths
     if path:
         os.chdir(path)
 
 
-def is_git_repo_clean() -> bool:
-    gitStatusOutput = subprocess.check_output(["git", "status"])
-    CLEAN_STRING = b"\nnothing to commit, working tree clean\n"
-    return CLEAN_STRING in gitStatusOutput
+def is_git_repo_clean(repo: str = ".") -> bool:
+    return query_git_state(repo).is_clean
 
 
 def ask_user_to_confirm(message: str) -> bool:
@@ -43,42 +142,164 @@ def exec(*args):
     print("[Command]", " ".join(args))
     subprocess.call(args)
 
+
+def run_quietly(args: List[str], cwd: str) -> subprocess.CompletedProcess:
+    # Used by the parallel mode: the output is captured, so that jobs do not print over each other
+    return subprocess.run(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+def get_last_line(process: subprocess.CompletedProcess) -> str:
+    lines = process.stdout.decode("utf-8", errors="replace").strip().splitlines()
+    return lines[-1] if lines else ""
+
+
+def get_skip_result(state: GitState, force: bool) -> Optional[RepoResult]:
+    # Decides from the git state alone, whether a repository needs to be built at all
+    if not state.is_repo:
+        return RepoResult(state.repo, FAILED, state.describe())
+    if not state.is_clean and not force:
+        return RepoResult(state.repo, SKIPPED, f"working tree not clean ({state.describe()})")
+    return None
+
+
+def update_projects(repos: List[str], apply: bool, jobs: int) -> List[api.UpdateResult]:
+    # Projects with the same configuration share a single build. Errors are returned, not raised
+    settings_list = [api.create_settings(repo) for repo in repos]
+    return api.update_projects(settings_list, apply=apply, jobs=jobs, raise_errors=False)
+
+
+def get_check_result(state: GitState, result: api.UpdateResult) -> RepoResult:
+    # Describes the result of building the template and checking for changes
+    if result.error:
+        return RepoResult(state.repo, FAILED, result.error)
+
+    details = state.describe() if state.ahead or state.behind else ""
+    if result.changes:
+        return RepoResult(state.repo, CHANGES, f"{len(result.changes)} file(s) {details}".strip())
+    else:
+        return RepoResult(state.repo, UP_TO_DATE, details)
+
+
+def commit_repo(result: api.UpdateResult, commit_message: str) -> RepoResult:
+    # The changes were already applied by update_projects
+    repo = result.project_dir
+    if result.error:
+        return RepoResult(repo, FAILED, result.error)
+
+    if commit_message:
+        for git_args in [["add", "."], ["commit", "-m", commit_message], ["push"]]:
+            process = run_quietly(["git"] + git_args, repo)
+            if process.returncode != 0:
+                return RepoResult(repo, FAILED, f"git {git_args[0]}: {get_last_line(process)}")
+        return RepoResult(repo, UPDATED, "committed and pushed")
+    return RepoResult(repo, UPDATED)
+
+
+def print_summary(results: List[RepoResult]):
+    width = max(len(result.repo) for result in results)
+    print()
+    print(f"{'Repository':<{width}}  {'Status':<10}  Details")
+    print(f"{'-' * width}  {'-' * 10}  {'-' * 7}")
+    for result in results:
+        print(f"{result.repo:<{width}}  {result.status:<10}  {result.details}")
+    print()
+
+
+def update_repos_in_parallel(project_folders: List[str], jobs: int, commit_message: str, force: bool):
+    # 1. Query the git state of all repositories, to not waste time building dirty ones
+    print(f"[INFO] Checking {len(project_folders)} project(s) with {jobs} job(s)")
+    # The builds run at the same time, their logs would be unreadable
+    utils.VERBOSE = False
+    states = query_git_states(project_folders, jobs)
+    results: Dict[str, RepoResult] = {}
+    to_check = []
+    for repo, state in states.items():
+        skip_result = get_skip_result(state, force)
+        if skip_result:
+            results[repo] = skip_result
+        else:
+            to_check.append(state)
+
+    # 2. Build the remaining templates at once and find the repositories that would change
+    update_results = update_projects([state.repo for state in to_check], apply=False, jobs=jobs)
+    for state, update_result in zip(to_check, update_results):
+        results[state.repo] = get_check_result(state, update_result)
+    results_list = [results[repo] for repo in project_folders]
+    print_summary(results_list)
+
+    # 3. Ask only once for all of them
+    to_update = [result.repo for result in results_list if result.status == CHANGES]
+    if not to_update:
+        print("[INFO] No project needs to be updated")
+        return
+    action = "Apply, commit and push" if commit_message else "Apply"
+    if not ask_user_to_confirm(f"{action} the changes in {len(to_update)} project(s)"):
+        return
+
+    # 4. Apply the changes. The builds were done in step 2, so they are normally served from the build cache
+    update_results = update_projects(to_update, apply=True, jobs=jobs)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        updated = list(executor.map(lambda result: commit_repo(result, commit_message), update_results))
+    print_summary(updated)
+
+
+def update_repos_sequentially(project_folders: List[str], commit_message: str, force: bool):
+    for repo in project_folders:
+        cd(repo)
+        is_clean = is_git_repo_clean()
+        if is_clean or force:
+            if not is_clean:
+                print("[WARN] Your working tree is not clean. Please chommit your changes before running this")
+            if ask_user_to_confirm(f"Updating '{repo}'"):
+                cd()
+                try:
+                    confirm = confirm_changes if CONFIRM_ACTIONS else None
+                    api.update_project(api.create_settings(repo), confirm=confirm)
+                except Exception as e:
+                    # Like in the parallel mode, a broken project must not stop the others
+                    print(f"[ERROR] Build failed: {type(e).__name__}: {e}")
+                    continue
+
+                cd(repo)
+                if is_git_repo_clean():
+                    print("[INFO] No files were changed")
+                else:
+                    exec("git", "status")
+                    if commit_message and ask_user_to_confirm("Commit and push the changes"):
+                        exec("git", "add", ".")
+                        exec("git", "commit", "-m", commit_message)
+                        exec("git", "push")
+        else:
+            ask_user_to_confirm(f"[WARN] Skipping '{repo}'. Reason: Working tree not clean")
+
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("project_search_root", help="this folder and its subfolders will be searched")
     ap.add_argument("-c", "--commit-message", help="commit the changes with the following message")
     ap.add_argument("-f", "--force", action="store_true", help="force update, even if the git working tree not clean")
+    ap.add_argument("-j", "--jobs", type=int, default=1, help="update this many projects in parallel. Confirmations are asked once for all projects")
+    ap.add_argument("-i", "--ignore", action="append", default=[], metavar="PATTERN", help=f"do not search folders matching this pattern (in addition to: {', '.join(DEFAULT_IGNORE_PATTERNS)})")
+    ap.add_argument("--max-depth", type=int, default=-1, help="how many folder levels below the search root are searched (default: unlimited)")
+    ap.add_argument("--cache-discovery", action="store_true", help="remember the found projects and reuse them if no searched folder changed")
     args = ap.parse_args()
 
     search_root_dir = args.project_search_root
-    commit_message = sys.argv[2]
 
     print(f"[INFO] Searching for projects in '{search_root_dir}'")
-    project_folders = search_for_configs(search_root_dir)
+    project_folders = search_for_configs(search_root_dir,
+                                         ignore_patterns=DEFAULT_IGNORE_PATTERNS + args.ignore,
+                                         max_depth=args.max_depth,
+                                         use_cache=args.cache_discovery)
     if project_folders:
         for project_dir in project_folders:
             print(f"[INFO] Found project folder: '{project_dir}'")
 
-        for repo in project_folders:
-            cd(repo)
-            is_clean = is_git_repo_clean()
-            if is_clean or args.force:
-                if not is_clean:
-                    print("[WARN] Your working tree is not clean. Please chommit your changes before running this")
-                if ask_user_to_confirm(f"Updating '{repo}'"):
-                    cd()
-                    exec("src/main.py", repo)
-
-                    cd(repo)
-                    if is_git_repo_clean():
-                        print("[INFO] No files were changed")
-                    else:
-                        exec("git", "status")
-                        if args.commit_message and ask_user_to_confirm("Commit and push the changes"):
-                            exec("git", "add", ".")
-                            exec("git", "commit", "-m", commit_message)
-                            exec("git", "push")
-            else:
-                ask_user_to_confirm(f"[WARN] Skipping '{repo}'. Reason: Working tree not clean")
+        # cd() changes the working dir, so relative paths would break
+        project_folders = [os.path.abspath(p) for p in project_folders]
+        if args.jobs > 1:
+            update_repos_in_parallel(project_folders, args.jobs, args.commit_message, args.force)
+        else:
+            update_repos_sequentially(project_folders, args.commit_message, args.force)
     else:
         print("[WARN] Found no project folders")
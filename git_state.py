@@ -0,0 +1,71 @@
+# Machine readable git repository state, based on "git status --porcelain=v2".
+# The porcelain format is stable and does not depend on the user's language settings
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple
+
+
+class GitState(NamedTuple):
+    repo: str
+    is_repo: bool
+    branch: str = ""
+    upstream: str = ""
+    # Commits that are not pushed / not pulled yet
+    ahead: int = 0
+    behind: int = 0
+    # Tracked files with staged or unstaged changes (including conflicts)
+    changed: int = 0
+    untracked: int = 0
+    error: str = ""
+
+    @property
+    def is_clean(self) -> bool:
+        return self.is_repo and self.changed == 0 and self.untracked == 0
+
+    def describe(self) -> str:
+        if not self.is_repo:
+            return self.error or "not a git repository"
+        parts = []
+        if self.changed:
+            parts.append(f"{self.changed} changed")
+        if self.untracked:
+            parts.append(f"{self.untracked} untracked")
+        if self.ahead:
+            parts.append(f"{self.ahead} ahead")
+        if self.behind:
+            parts.append(f"{self.behind} behind")
+        return ", ".join(parts) or "clean"
+
+
+def parse_porcelain_v2(repo: str, output: str) -> GitState:
+    branch = upstream = ""
+    ahead = behind = changed = untracked = 0
+    for line in output.splitlines():
+        if line.startswith("# branch.head "):
+            branch = line[len("# branch.head "):]
+        elif line.startswith("# branch.upstream "):
+            upstream = line[len("# branch.upstream "):]
+        elif line.startswith("# branch.ab "):
+            # Example: "# branch.ab +1 -0"
+            ahead_str, behind_str = line[len("# branch.ab "):].split()
+            ahead, behind = int(ahead_str), -int(behind_str)
+        elif line.startswith(("1 ", "2 ", "u ")):
+            changed += 1
+        elif line.startswith("? "):
+            untracked += 1
+    return GitState(repo, True, branch, upstream, ahead, behind, changed, untracked)
+
+
+def query_git_state(repo: str) -> GitState:
+    process = subprocess.run(["git", "status", "--porcelain=v2", "--branch"],
+                             cwd=repo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        error = process.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        return GitState(repo, False, error=error[0] if error else "git status failed")
+    return parse_porcelain_v2(repo, process.stdout.decode("utf-8", errors="replace"))
+
+
+def query_git_states(repos: List[str], jobs: int = 8) -> Dict[str, GitState]:
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        states = executor.map(query_git_state, repos)
+    return dict(zip(repos, states))
@@ -0,0 +1,139 @@
+# Library interface of the template tool, used by main.py and apply_to_repos.py.
+# None of these functions ask for input or exit the process: errors are raised as BuildError.
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+from pre_build import pre_build
+from build import build
+from post_build import post_build
+from apply import apply_changes, get_changed_files
+from cache import get_build_cache_key, get_template_fingerprint, get_uncacheable_hooks, restore_cached_build, \
+    store_build
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+TEMPLATE_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "template"))
+
+
+class BuildResult(NamedTuple):
+    cache_key: str
+    cache_hit: bool
+    # rel_path -> sha256 of the files in the build dir. Empty if the build cache is disabled
+    file_hashes: dict = {}
+
+
+class UpdateResult(NamedTuple):
+    project_dir: str
+    # rel_path -> status (see compare.py) of all files that differ from the project
+    changes: dict
+    applied: bool
+    cache_hit: bool
+    # "<exception type>: <message>" if the build failed and update_projects was called with raise_errors=False
+    error: str = ""
+
+
+def create_settings(project_dir: str, **kwargs) -> Settings:
+    return Settings(project_dir=project_dir, template_dir=kwargs.pop("template_dir", TEMPLATE_DIR), **kwargs)
+
+
+def build_template(settings: Settings, cache_key: str = "") -> BuildResult:
+    # Builds the template into settings.build_dir (see utils.build_workspace)
+    use_build_cache = settings.use_cache
+    custom_hooks = get_uncacheable_hooks(settings) if use_build_cache else []
+    if custom_hooks:
+        # The per-file caches (SASS, minify) are keyed by the file contents, so they are still used
+        log(f"Not using the build cache, since the config has custom hooks: {', '.join(custom_hooks)}")
+        use_build_cache = False
+    if use_build_cache:
+        cache_key = cache_key or get_build_cache_key(settings)
+        file_hashes = restore_cached_build(cache_key, settings.build_dir)
+        if file_hashes is not None:
+            log(f"Build cache hit ({cache_key[:12]}), skipping the build")
+            return BuildResult(cache_key, True, file_hashes)
+
+    # Each stage raises BuildError if something failed, so only complete builds are cached and applied
+    pre_build(settings)
+    build(settings)
+    post_build(settings)
+    if use_build_cache:
+        return BuildResult(cache_key, False, store_build(cache_key, settings.build_dir))
+    return BuildResult(cache_key, False)
+
+
+def diff_template(settings: Settings, build_result: Optional[BuildResult] = None) -> dict:
+    # Compares the build output with the project. Files that the template no longer produces are only
+    # marked as REMOVE, if the build_result of the (successful) build is passed
+    if build_result is None:
+        return get_changed_files(settings)
+    return get_changed_files(settings, build_result.file_hashes, build_complete=True)
+
+
+def update_project(settings: Settings, apply: bool = True,
+                   confirm: Optional[Callable[[dict], bool]] = None) -> UpdateResult:
+    # Builds, compares and (if apply is set and confirm does not return False) applies the template
+    return update_projects([settings], apply, confirm)[0]
+
+
+def update_projects(settings_list: List[Settings], apply: bool = True,
+                    confirm: Optional[Callable[[dict], bool]] = None,
+                    jobs: int = 1, raise_errors: bool = True) -> List[UpdateResult]:
+    # Like update_project, but for many projects. The build output only depends on the template and
+    # the project's config files, so every distinct configuration is built once and then compared
+    # with / applied to all projects that share it. The template is only hashed once.
+    # jobs: how many configurations are built at the same time.
+    # raise_errors: if False, a failing project gets an UpdateResult with the error instead of raising
+    template_fingerprints: Dict[str, str] = {}
+    groups: Dict[str, List[int]] = {}
+    for index, settings in enumerate(settings_list):
+        if settings.template_dir not in template_fingerprints:
+            template_fingerprints[settings.template_dir] = get_template_fingerprint(settings.template_dir)
+        cache_key = get_build_cache_key(settings, template_fingerprints[settings.template_dir])
+        if get_uncacheable_hooks(settings):
+            # The output may depend on any file of the project, so it is not shared with other projects
+            cache_key += f":{os.path.realpath(settings.project_dir)}"
+        groups.setdefault(cache_key, []).append(index)
+    if len(settings_list) > 1:
+        log(f"{len(settings_list)} project(s) use {len(groups)} distinct configuration(s)")
+
+    results: List[Optional[UpdateResult]] = [None] * len(settings_list)
+
+    def update_group(cache_key: str, indices: List[int]):
+        try:
+            with build_workspace(settings_list[indices[0]]) as build_settings:
+                build_result = build_template(build_settings, cache_key)
+                for index in indices:
+                    settings = settings_list[index]._replace(build_dir=build_settings.build_dir)
+                    try:
+                        results[index] = compare_and_apply(settings, build_result, apply, confirm)
+                    except Exception as e:
+                        results[index] = get_error_result(settings, e, raise_errors)
+        except Exception as e:
+            for index in indices:
+                if results[index] is None:
+                    results[index] = get_error_result(settings_list[index], e, raise_errors)
+
+    if jobs > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(lambda group: update_group(*group), groups.items()))
+    else:
+        for cache_key, indices in groups.items():
+            update_group(cache_key, indices)
+    return results  # type: ignore
+
+
+def get_error_result(settings: Settings, error: Exception, raise_errors: bool) -> UpdateResult:
+    if raise_errors:
+        raise error
+    return UpdateResult(settings.project_dir, {}, False, False, f"{type(error).__name__}: {error}")
+
+
+def compare_and_apply(settings: Settings, build_result: BuildResult, apply: bool,
+                      confirm: Optional[Callable[[dict], bool]]) -> UpdateResult:
+    changes = diff_template(settings, build_result)
+    applied = False
+    if apply:
+        if confirm:
+            log(f"Project: {settings.project_dir}")
+        applied = confirm is None or confirm(changes)
+    if applied:
+        apply_changes(settings, changes, build_result.file_hashes)
+    return UpdateResult(settings.project_dir, changes, applied, build_result.cache_hit)
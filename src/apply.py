@@ -1,37 +1,54 @@
 # pylint: disable=wildcard-import, unused-wildcard-import
 from utils import *
 import compare as FolderCompare
-from typing import List
+import manifest as Manifest
+from typing import Dict, List, Optional
 
 
-ASK = True
-
-
-def apply_template(settings: Settings):
-    changed_files = get_changed_files(settings)
-    if ASK:
-        confirm_changes(changed_files)
-
-    print("Applying the changes...")
-    for rel_path in changed_files:
-        src = os.path.join(BUILD_DIR, rel_path)
+def apply_changes(settings: Settings, changed_files: dict, build_hashes: Optional[Dict[str, str]] = None):
+    log("Applying the changes...")
+    old_stats = Manifest.load_stats(settings.project_dir)
+    for rel_path, status in changed_files.items():
         dst = os.path.join(settings.project_dir, rel_path)
-        my_copy(src, dst)
+        if status == FolderCompare.REMOVE:
+            os.remove(dst)
+        else:
+            src = os.path.join(settings.build_dir, rel_path)
+            my_copy(src, dst)
+
+    # Remember what was installed, so that the next run does not need to read every file
+    new_manifest, new_stats = Manifest.create_manifest(settings.build_dir, settings.project_dir, old_stats,
+                                                       build_hashes or {})
+    Manifest.save_stats(settings.project_dir, new_stats)
+    if changed_files:
+        # Otherwise the project would get a change that only touches the manifest
+        Manifest.save_manifest(settings.project_dir, new_manifest)
+
+
+def get_changed_files(settings: Settings, build_hashes: Optional[Dict[str, str]] = None,
+                      build_complete: bool = False) -> dict:
+    # build_hashes: rel_path -> sha256 of the build's files, if they are known (see cache.store_build).
+    # Files are only removed from the project, if the build is known to be complete
+    manifest = Manifest.load_manifest(settings.project_dir)
+    stats = Manifest.load_stats(settings.project_dir)
+    changes = Manifest.compare_with_manifest(settings.build_dir, settings.project_dir, manifest, stats,
+                                             build_hashes or {}, build_complete)
+    statusList = [FolderCompare.ADD, FolderCompare.CHANGED, FolderCompare.REMOVE]
+    return FolderCompare.filter_by_status(changes, statusList)
 
 
-def get_changed_files(settings: Settings) -> dict:
-    changes = FolderCompare.compare_folders(BUILD_DIR, settings.project_dir)
-    statusList = [FolderCompare.ADD, FolderCompare.CHANGED]
-    return FolderCompare.filter_by_status(changes, statusList)
+def confirm_changes(changed_files: dict) -> bool:
+    list_changes(changed_files)
+    if changed_files:
+        return ask_to_continue()
+    return True
 
 
-def confirm_changes(changed_files: dict):
+def list_changes(changed_files: dict):
     if changed_files:
         print("The following changes will be made")
         for relPath, status in changed_files.items():
             if status != FolderCompare.SAME:
                 print(" '{}': {}".format(relPath, status))
-
-        confirm_or_exit()
     else:
         print("No files will be changed")
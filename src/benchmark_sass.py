@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Compares the SASS backends on the stylesheets bundled with the template
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+from build import process_liquid
+from sass_compiler import BACKENDS, get_available_backends
+import argparse
+import statistics
+import tempfile
+import time
+import utils
+from typing import List
+# External libs
+from munch import munchify, DefaultMunch
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+TEMPLATE_PUBLIC_DIR = os.path.join(SCRIPT_DIR, "..", "template", "public")
+EXAMPLE_CONFIG = os.path.join(SCRIPT_DIR, "..", CONFIG_FILE_NAME)
+
+
+def prepare_stylesheets(dir_path: str) -> List[str]:
+    # Copies the stylesheets and renders the liquid ones with the example config
+    config = DefaultMunch.fromDict(munchify(parse_yaml_file(EXAMPLE_CONFIG)), "")
+    entry_points = []
+    for file_path in list_files(TEMPLATE_PUBLIC_DIR):
+        name = os.path.basename(file_path)
+        if ".scss" not in name and ".sass" not in name:
+            continue
+
+        dst = os.path.join(dir_path, name)
+        my_copy(file_path, dst)
+        if dst.endswith(".liquid"):
+            dst = process_liquid(config, dst, {})
+        if not name.startswith("_"):
+            entry_points.append(dst)
+    return entry_points
+
+
+def benchmark_backend(backend: str, entry_points: List[str], rounds: int) -> List[float]:
+    compile_sass = BACKENDS[backend]
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for input_path in entry_points:
+            output_path = input_path.rsplit(".", 1)[0] + ".css"
+            compile_sass(input_path, output_path, os.path.dirname(input_path))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--rounds", type=int, default=50, help="how often each backend compiles all stylesheets")
+    args = ap.parse_args()
+
+    # Do not log every rendered file
+    utils.VERBOSE = False
+    with tempfile.TemporaryDirectory(prefix="react-template-bench-") as tmp_dir:
+        entry_points = prepare_stylesheets(tmp_dir)
+        print(f"Compiling {len(entry_points)} stylesheet(s), {args.rounds} round(s) per backend")
+
+        backends = get_available_backends()
+        if not backends:
+            print("[WARN] No SASS backend is available")
+        for backend in backends:
+            durations = benchmark_backend(backend, entry_points, args.rounds)
+            print(f"{backend:>8}: mean {statistics.mean(durations) * 1000:7.2f} ms, "
+                  f"min {min(durations) * 1000:7.2f} ms per round")
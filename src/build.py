@@ -1,16 +1,56 @@
 # pylint: disable=wildcard-import, unused-wildcard-import
 from utils import *
+import hashlib
 import os
-import subprocess
-from typing import List, Any
-# External libs
-from liquid import Environment
-from munch import munchify, DefaultMunch
+import functools
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+from sass_compiler import BACKENDS, get_backend_id, resolve_backend_name, SASS_BACKEND_FIELD
+from scheduler import Step, run_steps
+import sass_deps
 
 LIQUID_FILE_EXTENSION = ".liquid"
-
-
-def process_liquid(config, file_path: str) -> str:
+# How many parsed templates are kept in memory
+LIQUID_CACHE_SIZE = 64
+
+# Shared by all builds in this process. Templates are rendered with the config passed
+# as a render argument, so the parsed templates do not depend on a specific project
+_liquid_env = None
+_liquid_templates: "OrderedDict[str, Any]" = OrderedDict()
+_liquid_lock = threading.Lock()
+# Reuse compiled stylesheets, if none of their (transitive) inputs changed
+SASS_CACHE_ENABLED = True
+
+
+def get_liquid_environment():
+    global _liquid_env
+    if _liquid_env is None:
+        # External libs are imported when they are needed, since a cached build does not use them
+        from liquid import Environment
+        _liquid_env = Environment()
+    return _liquid_env
+
+
+def get_liquid_template(file_contents: str):
+    # Returns the parsed template, only parsing it if it is not cached yet
+    key = hashlib.sha256(file_contents.encode(CODEC)).hexdigest()
+    with _liquid_lock:
+        template = _liquid_templates.get(key)
+        if template is not None:
+            _liquid_templates.move_to_end(key)
+            return template
+
+    template = get_liquid_environment().from_string(file_contents)
+
+    with _liquid_lock:
+        _liquid_templates[key] = template
+        while len(_liquid_templates) > LIQUID_CACHE_SIZE:
+            _liquid_templates.popitem(last=False)
+    return template
+
+
+def process_liquid(config, file_path: str, _dependency_graph: dict) -> str:
     log(f"Rendering liquid file: {file_path}")
 
     # Remove liquid extension
@@ -19,107 +59,173 @@ def process_liquid(config, file_path: str) -> str:
 
     # process with liquid
     def process_liquid_file_contents(file_contents):
-        liquid_vars = {"site":config}
-        liquid_env = Environment(globals=liquid_vars)
-        bound_template = liquid_env.from_string(file_contents)
-        return bound_template.render()
+        bound_template = get_liquid_template(file_contents)
+        return bound_template.render(site=config)
 
     replace_file_contents(new_file_path, process_liquid_file_contents)
 
     return new_file_path
 
 
-def process_scss(config, file_path: str) -> str:
+def process_scss(config, file_path: str, dependency_graph: dict) -> str:
     file_dir, file_name = os.path.split(file_path)
     if file_name.startswith("_"):
         # This file will probably be included by another liquid file
         return ""  # do not process the file
     else:
-        print(f"Compiling SASS file: {file_name}")
+        log(f"Compiling SASS file: {file_name}")
         # Change file extension to .css
         output_file_path = file_path[:-5] + ".css"
         import_folder = file_dir
-        subprocess.run(["sassc",
-                        "--style", "compressed",
-                        "--load-path", import_folder,
-                        file_path, output_file_path
-                        ])
+        backend = resolve_backend_name(config.get(SASS_BACKEND_FIELD))
+
+        dependencies = sass_deps.find_dependencies(file_path, [import_folder])
+        dependency_graph[output_file_path] = dependencies
+        if SASS_CACHE_ENABLED:
+            dependency_hashes = sass_deps.hash_dependencies(file_path, dependencies)
+            cache_key = sass_deps.get_stylesheet_cache_key(
+                file_path, dependency_hashes, get_backend_id(backend))
+            if sass_deps.restore_stylesheet(cache_key, output_file_path):
+                log(f"{file_name} is up to date, using the cached output")
+                return output_file_path
+
+        BACKENDS[backend](file_path, output_file_path, import_folder)
+
+        if SASS_CACHE_ENABLED:
+            sass_deps.store_stylesheet(cache_key, output_file_path, file_path, dependency_hashes)
         return output_file_path
 
 
 def process_file(config, file_path: str) -> str:
     if file_path.endswith(LIQUID_FILE_EXTENSION):
-        return process_liquid(config, file_path)
+        return process_liquid(config, file_path, {})
     elif file_path.endswith(".scss") or file_path.endswith(".sass"):
-        return process_scss(config, file_path)
+        return process_scss(config, file_path, {})
     else:
         return ""
 
 
+def get_liquid_output_name(file_name: str) -> Optional[str]:
+    return file_name[:-len(LIQUID_FILE_EXTENSION)]
+
+
+def get_scss_output_name(file_name: str) -> Optional[str]:
+    if file_name.startswith("_"):
+        # Partials are only imported by other stylesheets
+        return None
+    return file_name[:-5] + ".css"
+
+
+# Processors with a lower index run first: all files a processor may read (like SASS partials
+# created by rendering "_x.scss.liquid") are produced before any file is given to it
 FILE_EXTENSION_PRIORITIES = [
     {
         "extensions": [".liquid"],
         "fn": process_liquid,
+        "output_name": get_liquid_output_name,
     },
     {
         "extensions": [".scss", ".sass"],
         "fn": process_scss,
+        "output_name": get_scss_output_name,
     },
 ]
 
 
-def process_files_by_prioritizing_extensions(config, dir_path: str):
+def get_processor_index(file_name: str) -> int:
+    for index, processor in enumerate(FILE_EXTENSION_PRIORITIES):
+        extensions: Any = processor["extensions"]  # actually List[str]
+        if any(file_name.endswith(extension) for extension in extensions):
+            return index
+    return -1
+
+
+def get_processing_chain(file_name: str) -> List[Tuple[int, str]]:
+    # Derives the processors a file goes through from its suffixes.
+    # Example: "a.liquid.scss.liquid" -> liquid -> "a.liquid.scss" -> scss -> "a.liquid.css"
+    # Returns (processor index, output name) tuples. The output name is None if the step creates no file
+    chain = []
+    while file_name:
+        index = get_processor_index(file_name)
+        if index < 0:
+            break
+        output_name = FILE_EXTENSION_PRIORITIES[index]["output_name"](file_name)
+        chain.append((index, output_name))
+        file_name = output_name
+    return chain
+
+
+def create_processing_steps(config, files: List[str], dependency_graph: dict) -> List[Step]:
+    steps = []
+    # One barrier per processor, that waits for all steps producing inputs for that processor.
+    # This keeps the number of edges linear in the number of files
+    inputs_ready = [Step(f"<inputs for processor {i}>", lambda: None) for i in range(len(FILE_EXTENSION_PRIORITIES))]
+
+    for file_path in files:
+        folder, file_name = os.path.split(file_path)
+        previous_step = None
+        for index, output_name in get_processing_chain(file_name):
+            input_path = os.path.join(folder, file_name)
+            fn = FILE_EXTENSION_PRIORITIES[index]["fn"]
+            step = Step(input_path, functools.partial(fn, config, input_path, dependency_graph))
+            step.depends_on(inputs_ready[index])
+            if previous_step:
+                step.depends_on(previous_step)
+            steps.append(step)
+
+            if output_name:
+                # All later processors may read this file (eg. a partial imported by another stylesheet)
+                output_index = get_processor_index(output_name)
+                if output_index > index:
+                    for barrier in inputs_ready[index + 1:output_index + 1]:
+                        barrier.depends_on(step)
+                file_name = output_name
+            previous_step = step
+
+    # A barrier also waits for the barriers of all earlier processors, to keep the priority order
+    for index in range(1, len(inputs_ready)):
+        inputs_ready[index].depends_on(inputs_ready[index - 1])
+    return inputs_ready + steps
+
+
+def process_files_by_prioritizing_extensions(config, dir_path: str, worker_count: int = 1) -> Dict[str, List[str]]:
     # Advantages: has easier to understand processing of files
     #             Enables complicated stuff like a.liquid.scss.liquid
-    # Disadvantages: Harder to understand and debug code
-    processed_files: List[str] = []
-    while process_next_batch_of_files(config, dir_path, processed_files):
-        pass
-
-
-def process_next_batch_of_files(config, dir_path: str, processed_files: List[str]) -> bool:
-    # Finds the first (ie hightest priority) processor that can process files and lets it run
-    # Returns False it no more files can be processed
+    # Scans the folder once and runs every file's processors as soon as their inputs are ready
     files = list_files(dir_path)
-    for processor in FILE_EXTENSION_PRIORITIES:
-        extensions: Any = processor["extensions"]  # actually List[str]
-        matching_files = get_files_with_matching_extensions(files, extensions)
-        # Remove files that were already processed
-        matching_files = [f for f in matching_files if f not in processed_files]
-        if matching_files:
-            print("Processing next batch:", matching_files)
-            # Mark this batch of files as processed
-            processed_files.extend(matching_files)
-            # actually Callable[[type(config),str], str]
-            process_files: Any = processor["fn"]
-            for file_name in matching_files:
-                process_files(config, file_name)
-            return True
-    return False
-
-
-def get_files_with_matching_extensions(files: List[str], extension_list: List[str]) -> List[str]:
-    matching_files = []
-    for file_path in files:
-        for extension in extension_list:
-            if file_path.endswith(extension):
-                matching_files.append(file_path)
-    # Remove potential duplicates
-    matching_files = list(set(matching_files))
-    return matching_files
-
+    # Returned to the caller, so that it only lives as long as the build is needed (see watch.py)
+    dependency_graph: Dict[str, List[str]] = {}
+    steps = create_processing_steps(config, files, dependency_graph)
+    log(f"Scheduling {len(steps) - len(FILE_EXTENSION_PRIORITIES)} processing step(s) for {len(files)} file(s)")
+
+    errors = run_steps(steps, worker_count)
+    if errors:
+        for file_name, error in errors.items():
+            if isinstance(error, BuildError):
+                print(f"[ERROR] {file_name}: {error}")
+            else:
+                print(f"[ERROR] {file_name}: {type(error).__name__}: {error}")
+        raise BuildError(f"Failed to process {len(errors)} file(s)")
+    return dependency_graph
+
+
+def build(settings: Settings) -> Dict[str, List[str]]:
+    # Returns the SASS dependency graph: output path -> all files it was compiled from
+    from munch import munchify, DefaultMunch
+    global SASS_CACHE_ENABLED
+    SASS_CACHE_ENABLED = settings.use_cache
 
-def build(settings: Settings):
     log("Loading config")
-    config_path = os.path.join(BUILD_DIR, CONFIG_FILE_NAME)
+    config_path = os.path.join(settings.build_dir, CONFIG_FILE_NAME)
     config = parse_yaml_file(config_path)
     # Make the fields accessible from liquid
     config = DefaultMunch.fromDict(munchify(config), "")
     log("Config file loaded")
 
-    process_files_by_prioritizing_extensions(config, BUILD_DIR)
+    dependency_graph = process_files_by_prioritizing_extensions(config, settings.build_dir, get_worker_count(settings))
     # process_files_sequentially(config, ".")
     log("Build step done")
+    return dependency_graph
 
 
 def process_files_sequentially(config, dir_path: str):
@@ -0,0 +1,183 @@
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+import hashlib
+import json
+import platform
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+BUILD_CACHE_DIR = os.path.join(CACHE_DIR, "builds")
+# Bump this to invalidate all existing cache entries
+CACHE_FORMAT_VERSION = "2"
+# Only the newest entries are kept, the rest is deleted after storing a new build
+MAX_CACHED_BUILDS = 20
+# Files in the project dir, that (pre)build scripts read
+PROJECT_INPUT_FILES = [CONFIG_FILE_NAME, "i18n.yaml"]
+# Python packages used by the pipeline. Their versions may change the output
+# (brotli is optional, but whether it is installed changes the output of compress.py)
+TOOL_PACKAGES = ["pyyaml", "python-liquid", "munch", "htmlmin", "rcssmin", "rjsmin", "libsass", "brotli"]
+SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+IGNORED_FOLDERS = ["__pycache__", ".mypy_cache"]
+# A cache entry contains the build output and the hashes of its files (rel_path -> sha256)
+ENTRY_FILES_DIR = "files"
+ENTRY_HASHES_FILE = "hashes.json"
+
+
+def get_uncacheable_hooks(settings: Settings) -> List[str]:
+    # The cache key only covers PROJECT_INPUT_FILES, but custom hooks may read any other file of the project
+    try:
+        config = parse_yaml_file(os.path.join(settings.project_dir, CONFIG_FILE_NAME)) or {}
+    except Exception:
+        # pre_build reports the error
+        return []
+    return get_custom_hooks(config)
+
+
+def get_build_cache_key(settings: Settings, template_fingerprint: str = "") -> str:
+    # Hashes everything that may influence the build output.
+    # When building many projects, pass the result of get_template_fingerprint to only compute it once
+    hasher = hashlib.sha256()
+    hasher.update(f"format:{CACHE_FORMAT_VERSION}\n".encode(CODEC))
+    template_fingerprint = template_fingerprint or get_template_fingerprint(settings.template_dir)
+    hasher.update(f"template:{template_fingerprint}\n".encode(CODEC))
+
+    for name in PROJECT_INPUT_FILES:
+        path = os.path.join(settings.project_dir, name)
+        hash_file(hasher, f"project:{name}", path)
+
+    return hasher.hexdigest()
+
+
+def get_template_fingerprint(template_dir: str) -> str:
+    # Hashes the inputs that are the same for every project
+    hasher = hashlib.sha256()
+    hash_folder(hasher, "template", template_dir)
+    # The pipeline code itself is an input too
+    hash_folder(hasher, "src", SRC_DIR)
+
+    for line in get_tool_versions():
+        hasher.update(f"tool:{line}\n".encode(CODEC))
+
+    return hasher.hexdigest()
+
+
+def hash_folder(hasher, label: str, dir_path: str):
+    for file_path in sorted(list_files(dir_path)):
+        rel_path = remove_path_prefix(file_path, dir_path)
+        if any(part in IGNORED_FOLDERS for part in rel_path.split(os.sep)):
+            continue
+        hash_file(hasher, f"{label}:{rel_path}", file_path)
+
+
+def hash_file(hasher, label: str, path: str):
+    hasher.update(f"{label}\n".encode(CODEC))
+    try:
+        file_hash = hashlib.sha256(read_file_bytes(path)).hexdigest()
+    except FileNotFoundError:
+        file_hash = "<missing>"
+    hasher.update(f"{file_hash}\n".encode(CODEC))
+
+
+def get_tool_versions() -> List[str]:
+    # Slow to import and only needed here
+    from importlib import metadata
+    versions = [f"python {platform.python_version()}"]
+    for package in TOOL_PACKAGES:
+        try:
+            versions.append(f"{package} {metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package} <missing>")
+
+    sassc = shutil.which("sassc")
+    if sassc:
+        output = subprocess.run([sassc, "--version"], capture_output=True).stdout
+        versions.append(output.decode(CODEC, errors="replace").strip())
+    else:
+        versions.append("sassc <missing>")
+    return versions
+
+
+def get_cache_entry_path(cache_key: str) -> str:
+    return os.path.join(BUILD_CACHE_DIR, cache_key)
+
+
+def restore_cached_build(cache_key: str, build_dir: str) -> Optional[Dict[str, str]]:
+    # Copies the cached build output to the build dir and returns the hashes of its files.
+    # Returns None on a cache miss
+    entry = get_cache_entry_path(cache_key)
+    try:
+        file_hashes = json.loads(read_file_bytes(os.path.join(entry, ENTRY_HASHES_FILE)).decode(CODEC))
+    except (OSError, ValueError):
+        return None
+
+    rm_folder(build_dir)
+    # Cache entries are never modified, so the files can be shared
+    shutil.copytree(os.path.join(entry, ENTRY_FILES_DIR), build_dir, copy_function=link_or_copy)
+    # Mark the entry as recently used
+    os.utime(entry)
+    return file_hashes
+
+
+def hash_build_files(build_dir: str) -> Dict[str, str]:
+    file_hashes = {}
+    for file_path in list_files(build_dir):
+        rel_path = remove_path_prefix(file_path, build_dir)
+        file_hashes[rel_path] = hashlib.sha256(read_file_bytes(file_path)).hexdigest()
+    return file_hashes
+
+
+def store_build(cache_key: str, build_dir: str) -> Dict[str, str]:
+    # Returns the hashes of the build's files, so that comparing them with the project does not need to read them again
+    file_hashes = hash_build_files(build_dir)
+    entry = get_cache_entry_path(cache_key)
+    if os.path.isdir(entry):
+        return file_hashes
+
+    # Copy to a unique temporary name first, so that neither a crash nor other builds of the same
+    # key (in this or another process) can leave a partial entry
+    os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(prefix=f"{cache_key}.tmp-", dir=BUILD_CACHE_DIR)
+    try:
+        shutil.copytree(build_dir, os.path.join(tmp_entry, ENTRY_FILES_DIR))
+        write_file_bytes(os.path.join(tmp_entry, ENTRY_HASHES_FILE),
+                         json.dumps(file_hashes, sort_keys=True).encode(CODEC))
+        is_complete = is_complete_copy(build_dir, os.path.join(tmp_entry, ENTRY_FILES_DIR), file_hashes)
+    except (OSError, shutil.Error) as e:
+        print(f"[WARN] Can not store the build in the cache: {e}")
+        is_complete = False
+    if not is_complete:
+        rm_folder(tmp_entry)
+        return file_hashes
+
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process stored the same build in the meantime
+        rm_folder(tmp_entry)
+
+    prune_build_cache()
+    return file_hashes
+
+
+def is_complete_copy(build_dir: str, copy_dir: str, file_hashes: Dict[str, str]) -> bool:
+    # Checks that the copy contains exactly the hashed files, with the same sizes
+    copied_files = {remove_path_prefix(path, copy_dir) for path in list_files(copy_dir)}
+    if copied_files != set(file_hashes):
+        return False
+    return all(os.path.getsize(os.path.join(copy_dir, rel_path)) == os.path.getsize(os.path.join(build_dir, rel_path))
+               for rel_path in file_hashes)
+
+
+def prune_build_cache():
+    entries = []
+    for name in os.listdir(BUILD_CACHE_DIR):
+        path = os.path.join(BUILD_CACHE_DIR, name)
+        if os.path.isdir(path) and ".tmp-" not in name:
+            entries.append((os.stat(path).st_mtime, path))
+
+    entries.sort(reverse=True)
+    for _mtime, path in entries[MAX_CACHED_BUILDS:]:
+        log(f"Removing old build cache entry: {path}")
+        rm_folder(path)
+
@@ -1,10 +1,15 @@
 # pylint: disable=wildcard-import, unused-wildcard-import
 from utils import *
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
 SAME = "SAME"
 ADD = "ADD"
 CHANGED = "OVERWRITE"
+# Only used for files that the template installed earlier, see manifest.py
+REMOVE = "REMOVE"
+
+# Files are compared in blocks of this size, so that big files are never fully loaded
+CHUNK_SIZE = 64 * 1024
 
 
 def filter_by_status(changedFileList: dict, allowedStatusList: List[str]) -> dict:
@@ -17,24 +22,52 @@ def filter_by_status(changedFileList: dict, allowedStatusList: List[str]) -> dic
 
 def compare_folders(src_dir: str, dst_dir: str) -> dict:
     diff = {}
-    for root, _dirs, files in os.walk(src_dir):
-        for name in files:
-            src = os.path.join(root, name)
-            rel_path = remove_path_prefix(src, src_dir)
-            dst = os.path.join(dst_dir, rel_path)
-
-            status = check_file_status(src, dst)
-            diff[rel_path] = status
+    for rel_path, entry in scan_files(src_dir):
+        dst = os.path.join(dst_dir, rel_path)
+        # The directory entry already knows the stat data, no need to stat again
+        status = check_file_status(entry.path, dst, entry.stat())
+        diff[rel_path] = status
     return diff
 
 
-def check_file_status(src: str, dst: str) -> str:
-    if not os.path.exists(dst):
+def scan_files(dir_path: str, rel_dir: str = "") -> Iterator[Tuple[str, os.DirEntry]]:
+    # Yields (relative path, directory entry) for all files in the folder and its subfolders
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path, rel_path)
+            else:
+                yield rel_path, entry
+
+
+def check_file_status(src: str, dst: str, src_stat: Optional[os.stat_result] = None) -> str:
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
         return ADD
 
-    src_bytes = read_file_bytes(src)
-    dst_bytes = read_file_bytes(dst)
-    if src_bytes == dst_bytes:
+    if src_stat is None:
+        src_stat = os.stat(src)
+    if os.path.samestat(src_stat, dst_stat):
+        # Both are (hard links to) the same file
+        return SAME
+    if src_stat.st_size != dst_stat.st_size:
+        return CHANGED
+
+    if files_have_same_content(src, dst):
         return SAME
     else:
         return CHANGED
+
+
+def files_have_same_content(path_a: str, path_b: str) -> bool:
+    # Stops at the first block that differs
+    with open(path_a, "rb") as file_a, open(path_b, "rb") as file_b:
+        while True:
+            block_a = file_a.read(CHUNK_SIZE)
+            block_b = file_b.read(CHUNK_SIZE)
+            if block_a != block_b:
+                return False
+            if not block_a:
+                return True
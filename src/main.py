@@ -1,30 +1,71 @@
 #!/usr/bin/env python3
 # pylint: disable=wildcard-import, unused-wildcard-import
-from utils import Settings
-from pre_build import pre_build
-from build import build
-from post_build import post_build
-from apply import apply_template
+from utils import Settings, BuildError
+from api import update_projects, TEMPLATE_DIR
+from apply import confirm_changes, list_changes
+from typing import List
+import argparse
 import sys
-import os
 
-SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+# Exit code of a dry run, that found changes which would be applied
+CHANGES_PENDING_EXIT_CODE = 3
 
 
-def build_and_apply_template(settings: Settings):
-    pre_build(settings)
-    build(settings)
-    post_build(settings)
-    apply_template(settings)
+def build_and_apply_template(settings: Settings, dry_run: bool = False, ask: bool = True) -> dict:
+    # Returns the changes to the project (that were applied, or would be applied in a dry run)
+    return build_and_apply_templates([settings], dry_run, ask)[0]
+
+
+def build_and_apply_templates(settings_list: List[Settings], dry_run: bool = False, ask: bool = True) -> List[dict]:
+    # Batch mode: the template is prepared once and each distinct project configuration is built once
+    confirm = confirm_changes if ask else None
+    results = update_projects(settings_list, apply=not dry_run, confirm=confirm)
+    for result in results:
+        if dry_run:
+            if len(results) > 1:
+                print(f"Project: {result.project_dir}")
+            list_changes(result.changes)
+        elif not result.applied:
+            print(f"Aborted: {result.project_dir}")
+    return [result.changes for result in results]
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <project_dir>")
-        sys.exit(1)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("project_dir", nargs="+", help="the react project(s) that the template should be applied to")
+    ap.add_argument("--no-cache", action="store_true", help="always rebuild, do not use or fill the build cache")
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="number of files processed in parallel (default: number of CPUs)")
+    ap.add_argument("--build-root", default="", help="folder to create the build dir in (default: the system's temp dir)")
+    ap.add_argument("--keep-build-dir", action="store_true", help="do not delete the build dir afterwards (for debugging)")
+    ap.add_argument("-y", "--yes", action="store_true", help="apply the changes without asking for confirmation")
+    ap.add_argument("--watch", action="store_true", help="keep running and rebuild + apply the template whenever it or the project config changes (without asking)")
+    ap.add_argument("--dry-run", action="store_true", help=f"only list the changes. Exits with {CHANGES_PENDING_EXIT_CODE} if there are any")
+    args = ap.parse_args()
+    if args.watch and (args.dry_run or len(args.project_dir) > 1):
+        ap.error("--watch only supports a single project and no --dry-run")
 
-    project_dir = sys.argv[1]
-    template_dir = os.path.join(SCRIPT_DIR, "..", "template")
-    settings = Settings(project_dir=project_dir, template_dir=template_dir)
+    settings_list = [Settings(project_dir=project_dir,
+                              template_dir=TEMPLATE_DIR,
+                              use_cache=not args.no_cache,
+                              jobs=args.jobs,
+                              build_root=args.build_root,
+                              keep_build_dir=args.keep_build_dir)
+                     for project_dir in args.project_dir]
+
+    if args.watch:
+        # Imported here, since it is not needed for normal builds
+        from watch import watch_project
+        try:
+            watch_project(settings_list[0])
+        except KeyboardInterrupt:
+            print()
+        sys.exit(0)
+
+    try:
+        changes_list = build_and_apply_templates(settings_list, args.dry_run, not args.yes)
+    except BuildError as e:
+        print(f"[ERROR] Build failed: {e}")
+        sys.exit(1)
 
-    build_and_apply_template(settings)
+    if args.dry_run and any(changes_list):
+        sys.exit(CHANGES_PENDING_EXIT_CODE)
@@ -0,0 +1,153 @@
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+import compare as FolderCompare
+import hashlib
+import json
+from typing import Dict, Optional, Tuple
+
+# Records what the template installed into a project: {rel_path: sha256}. It is committed with the project,
+# so it must not contain anything that is specific to a checkout
+MANIFEST_FILE_NAME = ".react-template-manifest.json"
+MANIFEST_VERSION = 2
+# The size and modification time of the installed files are machine-local, so they are stored in the cache:
+# {rel_path: {size, mtime_ns, sha256}} per project
+STATS_DIR = os.path.join(CACHE_DIR, "manifest-stats")
+# If more of the installed files would be removed, the build is probably incomplete
+MAX_REMOVED_SHARE = 0.5
+
+
+def get_manifest_path(project_dir: str) -> str:
+    return os.path.join(project_dir, MANIFEST_FILE_NAME)
+
+
+def load_manifest(project_dir: str) -> Dict[str, str]:
+    try:
+        data = json.loads(read_file_bytes(get_manifest_path(project_dir)).decode(CODEC))
+    except (FileNotFoundError, ValueError):
+        return {}
+    if data.get("version") == 1:
+        # Version 1 stored the stats in the manifest too
+        return {rel_path: entry.get("sha256") for rel_path, entry in data.get("files", {}).items()}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("files", {})
+
+
+def save_manifest(project_dir: str, files: Dict[str, str]):
+    data = {
+        "version": MANIFEST_VERSION,
+        "files": files,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True) + "\n"
+    path = get_manifest_path(project_dir)
+    # Do not touch the file (and the project's git status), if nothing changed
+    try:
+        if read_file_bytes(path).decode(CODEC) == text:
+            return
+    except FileNotFoundError:
+        pass
+    write_file_bytes(path, text.encode(CODEC))
+
+
+def get_stats_path(project_dir: str) -> str:
+    project_id = hashlib.sha256(os.path.realpath(project_dir).encode(CODEC)).hexdigest()
+    return os.path.join(STATS_DIR, f"{project_id}.json")
+
+
+def load_stats(project_dir: str) -> Dict[str, dict]:
+    try:
+        return json.loads(read_file_bytes(get_stats_path(project_dir)).decode(CODEC))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_stats(project_dir: str, stats: Dict[str, dict]):
+    write_file_bytes(get_stats_path(project_dir), json.dumps(stats, sort_keys=True).encode(CODEC))
+
+
+def hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FolderCompare.CHUNK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def get_trusted_hash(entry: Optional[dict], stat: os.stat_result) -> Optional[str]:
+    # The hash in the stats is only valid, if the file was not touched since it was recorded
+    if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return entry.get("sha256")
+    return None
+
+
+def compare_with_manifest(build_dir: str, project_dir: str, manifest: Dict[str, str], stats: Dict[str, dict],
+                          build_hashes: Dict[str, str], build_complete: bool) -> dict:
+    # build_hashes (rel_path -> sha256) may contain the hashes of the build's files, so they are not read again
+    diff = {}
+    for rel_path, entry in FolderCompare.scan_files(build_dir):
+        dst = os.path.join(project_dir, rel_path)
+        try:
+            dst_stat = os.stat(dst)
+        except FileNotFoundError:
+            diff[rel_path] = FolderCompare.ADD
+            continue
+
+        src_stat = entry.stat()
+        dst_hash = get_trusted_hash(stats.get(rel_path), dst_stat)
+        if dst_hash is None:
+            # Unknown or modified file: compare the contents
+            diff[rel_path] = FolderCompare.check_file_status(entry.path, dst, src_stat)
+        elif src_stat.st_size != dst_stat.st_size or (build_hashes.get(rel_path) or hash_file(entry.path)) != dst_hash:
+            diff[rel_path] = FolderCompare.CHANGED
+        else:
+            diff[rel_path] = FolderCompare.SAME
+
+    if not build_complete:
+        # A file may only be missing, because the build failed
+        return diff
+
+    # Files that were installed by an earlier run, but are no longer produced by the template
+    removed = []
+    for rel_path, recorded_hash in manifest.items():
+        if rel_path in diff:
+            continue
+        dst = os.path.join(project_dir, rel_path)
+        try:
+            dst_stat = os.stat(dst)
+        except FileNotFoundError:
+            continue
+
+        dst_hash = get_trusted_hash(stats.get(rel_path), dst_stat) or hash_file(dst)
+        if dst_hash == recorded_hash:
+            removed.append(rel_path)
+        else:
+            # Keep files that the user modified
+            print(f"[WARN] '{rel_path}' is no longer part of the template, but was modified. Keeping it")
+
+    if len(removed) > MAX_REMOVED_SHARE * len(manifest):
+        raise BuildError(f"{len(removed)} of the {len(manifest)} installed files would be removed, the build looks "
+                         f"incomplete. Delete {MANIFEST_FILE_NAME} if this is intended")
+    for rel_path in removed:
+        diff[rel_path] = FolderCompare.REMOVE
+    return diff
+
+
+def create_manifest(build_dir: str, project_dir: str, old_stats: Dict[str, dict],
+                    build_hashes: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, dict]]:
+    # Describes the installed files. Returns the manifest and the stats.
+    # After applying, the project files have the build's contents,
+    # so only files that look modified and whose build hash is unknown are hashed
+    files = {}
+    stats = {}
+    for rel_path, _entry in FolderCompare.scan_files(build_dir):
+        dst_stat = os.stat(os.path.join(project_dir, rel_path))
+        file_hash = get_trusted_hash(old_stats.get(rel_path), dst_stat) or build_hashes.get(rel_path)
+        if file_hash is None:
+            file_hash = hash_file(os.path.join(project_dir, rel_path))
+        files[rel_path] = file_hash
+        stats[rel_path] = {
+            "size": dst_stat.st_size,
+            "mtime_ns": dst_stat.st_mtime_ns,
+            "sha256": file_hash,
+        }
+    return files, stats
@@ -8,25 +8,25 @@ POST_BUILD_COMMANDS = "post_build"
 
 def post_build(settings: Settings):
     # Run the command from the config file (if specified)
-    config_path = os.path.join(BUILD_DIR, CONFIG_FILE_NAME)
+    config_path = os.path.join(settings.build_dir, CONFIG_FILE_NAME)
     config = parse_yaml_file(config_path)
     build_commands = config.get(POST_BUILD_COMMANDS)
 
     if build_commands:
-        run_commands(settings.project_dir, build_commands)
+        run_commands(settings, build_commands)
 
     # remove the template tools
-    tool_folder = os.path.join(BUILD_DIR, "template-tools")
+    tool_folder = os.path.join(settings.build_dir, "template-tools")
     rm_folder(tool_folder)
 
     # Remove the config we copied over in pre_build
     os.remove(config_path)
 
     # Remove all SASS files (no longer needed, since they were compiled to CSS)
-    for file_path in list_files(BUILD_DIR):
+    for file_path in list_files(settings.build_dir):
         if file_path.endswith(".scss") or file_path.endswith(".sass"):
             os.remove(file_path)
 
     # Final clean up
-    remove_cache_files(BUILD_DIR)
+    remove_cache_files(settings.build_dir)
 
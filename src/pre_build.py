@@ -1,58 +1,72 @@
 # pylint: disable=wildcard-import, unused-wildcard-import
 from utils import *
+import utils
 from typing import List
 import os
 import subprocess
 from pathlib import Path
 
 PRE_BUILD_COMMANDS = "pre_build"
+CACHE_FOLDER_NAMES = [".mypy_cache", "__pycache__"]
+# Tells the plugin scripts where they can cache their results. Empty if caching is disabled
+# @SYNC with: ../template/template-tools/minify.py CACHE_DIR_ENV_VAR
+CACHE_DIR_ENV_VAR = "REACT_TEMPLATE_CACHE_DIR"
 
 
 def pre_build(settings: Settings):
-    # Delete the build dir and make sure its parent exists
-    empty_folder(BUILD_DIR)
-    rm_folder(BUILD_DIR)
+    # Start with an empty build dir
+    empty_folder(settings.build_dir)
 
-    # Copy the template to the build dir
-    shutil.copytree(settings.template_dir, BUILD_DIR)
+    # Link the template files into the build dir. Unchanged files are never copied,
+    # and processed files replace their link with a new file.
+    # The project's own hooks may modify files in place, which would change the template through the link
+    src = os.path.join(settings.project_dir, CONFIG_FILE_NAME)
+    custom_hooks = get_custom_hooks(parse_yaml_file(src) or {})
+    if custom_hooks:
+        log("Copying the template, since the config has custom hooks")
+    shutil.copytree(settings.template_dir, settings.build_dir,
+                    copy_function=shutil.copy2 if custom_hooks else link_or_copy,
+                    ignore=shutil.ignore_patterns(*CACHE_FOLDER_NAMES),
+                    dirs_exist_ok=True)
 
     # Copy the config file, so that it can be modified by (pre)build scripts
-    src = os.path.join(settings.project_dir, CONFIG_FILE_NAME)
-    config_path = os.path.join(BUILD_DIR, CONFIG_FILE_NAME)
+    config_path = os.path.join(settings.build_dir, CONFIG_FILE_NAME)
     my_copy(src, config_path)
 
-    # Clean up a bit
-    remove_cache_files(BUILD_DIR)
-
     # Run the pre_build commands (if they are specified in the config file)
     config = parse_yaml_file(config_path)
     build_commands = config.get(PRE_BUILD_COMMANDS)
 
     if build_commands:
-        run_commands(settings.project_dir, build_commands)
+        run_commands(settings, build_commands)
 
     
 
-def run_commands(project_dir: str, commands: List[str]):
-    # Change into the template directory
-    old_cwd = os.getcwd()
-    os.chdir(BUILD_DIR)
-
-    # Run the build commands in the copy
-    absolute_project_dir = os.path.join(old_cwd, project_dir)
+def run_commands(settings: Settings, commands: List[str]):
+    # Run the build commands in the build dir. The working dir of this process is not changed,
+    # so that multiple builds can run in parallel
+    absolute_project_dir = os.path.abspath(settings.project_dir)
+    env = dict(os.environ)
+    env[CACHE_DIR_ENV_VAR] = CACHE_DIR if settings.use_cache else ""
     for command in commands:
         # @SYNC to: ../template-tools/defaults.py
         command = str(command).replace("<PROJECT>", absolute_project_dir)
-        print(f" Executing: {command} ".center(80, "="))
-        subprocess.call(command, shell=True)
-
-    # Change back to the old working dir
-    os.chdir(old_cwd)
+        log(f" Executing: {command} ".center(80, "="))
+        if utils.VERBOSE:
+            returncode = subprocess.call(command, shell=True, cwd=settings.build_dir, env=env)
+        else:
+            # Only show the output, if something went wrong
+            process = subprocess.run(command, shell=True, cwd=settings.build_dir, env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            returncode = process.returncode
+            if returncode != 0:
+                print(process.stdout.decode(CODEC, errors="replace"))
+        if returncode != 0:
+            # The output would be incomplete, so it must neither be cached nor applied
+            raise BuildError(f"Command failed with code {returncode}: {command}")
 
 def remove_cache_files(root_dir: str):
-    for path in Path(root_dir).rglob('.mypy_cache'):
-        log(f"Removing cache folder: {path}")
-        rm_folder(str(path))
-    for path in Path(root_dir).rglob('__pycache__'):
-        log(f"Removing cache folder: {path}")
-        rm_folder(str(path))
\ No newline at end of file
+    for name in CACHE_FOLDER_NAMES:
+        for path in Path(root_dir).rglob(name):
+            log(f"Removing cache folder: {path}")
+            rm_folder(str(path))
@@ -0,0 +1,75 @@
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+import functools
+import importlib.util
+import subprocess
+from typing import Callable, Dict, List
+
+# Config field (react-template.yaml) that selects the compiler
+SASS_BACKEND_FIELD = "sass_backend"
+AUTO = "auto"
+LIBSASS = "libsass"
+SASSC = "sassc"
+OUTPUT_STYLE = "compressed"
+
+
+def compile_with_libsass(input_path: str, output_path: str, load_path: str):
+    # In-process compilation, see https://sass.github.io/libsass-python/
+    import sass
+    try:
+        css = sass.compile(filename=input_path,
+                           output_style=OUTPUT_STYLE,
+                           include_paths=[load_path])
+    except sass.CompileError as e:
+        raise BuildError(f"libsass failed: {e}")
+    write_file_bytes(output_path, css.encode(CODEC))
+
+
+def compile_with_sassc(input_path: str, output_path: str, load_path: str):
+    result = subprocess.run(["sassc",
+                             "--style", OUTPUT_STYLE,
+                             "--load-path", load_path,
+                             input_path, output_path
+                             ], capture_output=True)
+    if result.returncode != 0:
+        error = result.stderr.decode(CODEC, errors="replace").strip()
+        raise BuildError(f"sassc exited with code {result.returncode}: {error}")
+
+
+BACKENDS: Dict[str, Callable[[str, str, str], None]] = {
+    LIBSASS: compile_with_libsass,
+    SASSC: compile_with_sassc,
+}
+
+
+def is_libsass_available() -> bool:
+    return importlib.util.find_spec("sass") is not None
+
+
+def get_available_backends() -> List[str]:
+    available = []
+    if is_libsass_available():
+        available.append(LIBSASS)
+    if shutil.which("sassc"):
+        available.append(SASSC)
+    return available
+
+
+def resolve_backend_name(name: str) -> str:
+    name = (name or AUTO).lower()
+    if name == AUTO:
+        # Prefer the in-process compiler, since it does not need to spawn a process per file
+        return LIBSASS if is_libsass_available() else SASSC
+    if name not in BACKENDS:
+        raise BuildError(f"Unknown {SASS_BACKEND_FIELD} '{name}', expected one of: {AUTO}, {', '.join(BACKENDS)}")
+    return name
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend_id(name: str) -> str:
+    # Name and version of a backend. Different versions may produce different output
+    if name == LIBSASS:
+        import sass
+        return f"{LIBSASS} {sass.__version__}"
+    result = subprocess.run(["sassc", "--version"], capture_output=True)
+    return result.stdout.decode(CODEC, errors="replace").strip() or SASSC
@@ -0,0 +1,111 @@
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+import hashlib
+import json
+import re
+import threading
+from typing import Dict, List, Optional
+
+SASS_CACHE_DIR = os.path.join(CACHE_DIR, "sass")
+SASS_EXTENSIONS = [".scss", ".sass"]
+COMMENT_PATTERN = re.compile(r"/\*.*?\*/|//[^\n]*", re.DOTALL)
+# The comma separated list of quoted names (that may span multiple lines), but not the "as" / "with" part
+IMPORT_PATTERN = re.compile(r"""@(?:import|use|forward)\s+((?:["'][^"']+["']\s*,\s*)*["'][^"']+["'])""")
+QUOTED_PATTERN = re.compile(r"""["']([^"']+)["']""")
+
+
+def parse_imports(file_contents: str) -> List[str]:
+    file_contents = COMMENT_PATTERN.sub("", file_contents)
+    imports = []
+    for match in IMPORT_PATTERN.finditer(file_contents):
+        for name in QUOTED_PATTERN.findall(match.group(1)):
+            # Plain CSS imports are not resolved by the compiler
+            if name.startswith("sass:") or name.endswith(".css") or "://" in name:
+                continue
+            imports.append(name)
+    return imports
+
+
+def resolve_import(name: str, importer_dir: str, load_paths: List[str]) -> Optional[str]:
+    # Follows the SASS rules: "foo" may be "_foo.scss", "foo.scss", "foo/_index.scss", ...
+    for base_dir in [importer_dir] + load_paths:
+        folder, base_name = os.path.split(os.path.join(base_dir, name))
+        candidates = []
+        for extension in [""] + SASS_EXTENSIONS:
+            candidates.append(os.path.join(folder, f"_{base_name}{extension}"))
+            candidates.append(os.path.join(folder, f"{base_name}{extension}"))
+        for extension in SASS_EXTENSIONS:
+            candidates.append(os.path.join(folder, base_name, f"_index{extension}"))
+            candidates.append(os.path.join(folder, base_name, f"index{extension}"))
+
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return os.path.normpath(candidate)
+    return None
+
+
+def find_dependencies(entry_path: str, load_paths: List[str]) -> List[str]:
+    # Returns the entry point and all files it (transitively) imports
+    entry_path = os.path.normpath(entry_path)
+    found = {entry_path}
+    to_visit = [entry_path]
+    while to_visit:
+        file_path = to_visit.pop()
+        file_contents = read_file_bytes(file_path).decode(CODEC)
+        for name in parse_imports(file_contents):
+            dependency = resolve_import(name, os.path.dirname(file_path), load_paths)
+            if dependency is None:
+                # Let the compiler report it
+                log(f"Could not resolve import '{name}' in {file_path}")
+            elif dependency not in found:
+                found.add(dependency)
+                to_visit.append(dependency)
+    return sorted(found)
+
+
+def hash_dependencies(entry_path: str, dependencies: List[str]) -> Dict[str, str]:
+    # Content hashes, with paths relative to the entry point's folder
+    entry_dir = os.path.dirname(entry_path)
+    hashes = {}
+    for file_path in dependencies:
+        rel_path = os.path.relpath(file_path, entry_dir)
+        hashes[rel_path] = hashlib.sha256(read_file_bytes(file_path)).hexdigest()
+    return hashes
+
+
+def get_stylesheet_cache_key(entry_path: str, dependency_hashes: Dict[str, str], compiler_id: str) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(f"compiler:{compiler_id}\n".encode(CODEC))
+    hasher.update(f"entry:{os.path.basename(entry_path)}\n".encode(CODEC))
+    for rel_path, file_hash in sorted(dependency_hashes.items()):
+        hasher.update(f"{rel_path}:{file_hash}\n".encode(CODEC))
+    return hasher.hexdigest()
+
+
+def restore_stylesheet(cache_key: str, output_path: str) -> bool:
+    cached_css = os.path.join(SASS_CACHE_DIR, cache_key + ".css")
+    if not os.path.isfile(cached_css):
+        return False
+    my_copy(cached_css, output_path)
+    return True
+
+
+def store_stylesheet(cache_key: str, output_path: str, entry_path: str, dependency_hashes: Dict[str, str]):
+    # The dependency graph is stored next to the output, so that it can be inspected
+    graph = {
+        "entry": os.path.basename(entry_path),
+        "dependencies": dependency_hashes,
+    }
+    graph_path = os.path.join(SASS_CACHE_DIR, cache_key + ".json")
+    write_file_bytes(graph_path, json.dumps(graph, indent=2, sort_keys=True).encode(CODEC))
+    # Write the css last, since its existence marks the entry as complete
+    cached_css = os.path.join(SASS_CACHE_DIR, cache_key + ".css")
+    tmp_path = f"{cached_css}.tmp-{os.getpid()}-{threading.get_ident()}"
+    my_copy(output_path, tmp_path)
+    os.replace(tmp_path, cached_css)
+
+
+def get_outputs_depending_on(dependency_graph: Dict[str, List[str]], file_path: str) -> List[str]:
+    # dependency_graph is returned by build.build: output path -> all files it was compiled from
+    file_path = os.path.normpath(file_path)
+    return [output for output, dependencies in dependency_graph.items() if file_path in dependencies]
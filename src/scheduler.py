@@ -0,0 +1,75 @@
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Set
+
+
+class Step:
+    # A node in the processing DAG. It only runs, after all its dependencies succeeded
+    def __init__(self, name: str, fn: Callable[[], object]):
+        self.name = name
+        self.fn = fn
+        self.dependencies: Set["Step"] = set()
+        self.dependents: List["Step"] = []
+
+    def depends_on(self, other: "Step"):
+        if other not in self.dependencies:
+            self.dependencies.add(other)
+            other.dependents.append(self)
+
+    def __repr__(self) -> str:
+        return f"Step({self.name})"
+
+
+def run_steps(steps: List[Step], worker_count: int = 1) -> Dict[str, Exception]:
+    # Runs every step as soon as its dependencies are done. Returns the errors by step name.
+    # Steps that depend on a failed step are skipped.
+    remaining = {step: len(step.dependencies) for step in steps}
+    ready = [step for step in steps if remaining[step] == 0]
+    errors: Dict[str, Exception] = {}
+
+    def mark_done(step: Step, failed: bool):
+        for dependent in step.dependents:
+            if failed:
+                skip(dependent)
+            elif dependent in remaining:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+    def skip(step: Step):
+        # Skipped steps count as failed, so that their dependents are skipped too
+        if step in remaining and step.name not in errors:
+            errors[step.name] = BuildError("Skipped, because a dependency failed")
+            del remaining[step]
+            mark_done(step, True)
+
+    with ThreadPoolExecutor(max_workers=max(1, worker_count)) as executor:
+        running = {}
+        while ready or running:
+            while ready:
+                step = ready.pop()
+                if step in remaining:
+                    running[executor.submit(step.fn)] = step
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if step not in remaining:
+                    continue
+                del remaining[step]
+                try:
+                    future.result()
+                    mark_done(step, False)
+                except Exception as e:
+                    # Any error (like a template syntax error or a missing compiler) only fails this step
+                    errors[step.name] = e
+                    mark_done(step, True)
+
+    if remaining:
+        # Only possible with circular dependencies
+        for step in remaining:
+            errors[step.name] = BuildError("Circular dependency")
+    return errors
@@ -1,21 +1,41 @@
 import shutil
 import os
 import sys
-from typing import NamedTuple, List, Callable
-# External library
-import yaml
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple, List, Callable, Iterator
 
 
 # Constants that may be used in multiple places
 CODEC = "utf-8"
-BUILD_DIR = "/tmp/react-template"
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "react-template")
 CONFIG_FILE_NAME = "react-template.yaml"
 VERBOSE = True
+# @SYNC with: pre_build.py PRE_BUILD_COMMANDS, post_build.py POST_BUILD_COMMANDS
+HOOK_FIELDS = ["pre_build", "post_build"]
+# Hooks bundled with the template. They write new files instead of modifying them and only read the config files
+TEMPLATE_TOOLS_PREFIX = "template-tools/"
 
 
 class Settings(NamedTuple):
     project_dir: str
     template_dir: str
+    use_cache: bool = True
+    # Number of worker threads, 0 means one per CPU
+    jobs: int = 0
+    # The workspace of this build, see build_workspace
+    build_dir: str = ""
+    # Where the workspaces are created. Empty means the system's temp dir
+    build_root: str = ""
+    # Do not delete the workspace after the build (for debugging)
+    keep_build_dir: bool = False
+
+
+class BuildError(Exception):
+    pass
 
 
 def log(msg: str):
@@ -23,6 +43,26 @@ def log(msg: str):
         print(msg)
 
 
+def get_worker_count(settings: Settings) -> int:
+    return settings.jobs or os.cpu_count() or 1
+
+
+@contextmanager
+def build_workspace(settings: Settings) -> Iterator[Settings]:
+    # Creates a unique build dir, so that multiple builds can run at the same time.
+    # Yields the settings with build_dir set to it
+    if settings.build_root:
+        os.makedirs(settings.build_root, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix="react-template-", dir=settings.build_root or None)
+    try:
+        yield settings._replace(build_dir=build_dir)
+    finally:
+        if settings.keep_build_dir:
+            print(f"[INFO] Keeping the build dir: {build_dir}")
+        else:
+            rm_folder(build_dir)
+
+
 def rm_folder(path: str):
     try:
         shutil.rmtree(path)
@@ -44,9 +84,21 @@ def mk_parent_dir(path: str):
 
 def my_copy(src: str, dst: str):
     mk_parent_dir(dst)
+    # The destination may be a hard link (see link_or_copy), so never write through it
+    if os.path.lexists(dst):
+        os.remove(dst)
     shutil.copy(src, dst)
 
 
+def link_or_copy(src: str, dst: str):
+    # Hard links are much cheaper than copies, but only work on the same file system.
+    # Files created this way must never be modified in place: write a new file and replace the link
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 def remove_path_prefix(path: str, prefix_to_remove: str) -> str:
     # remove prefix
     path = path[len(prefix_to_remove):]
@@ -63,16 +115,18 @@ def replace_file_contents(path: str, fn: Callable[[str], str]):
     # modify
     file_contents = str(fn(file_contents))
     # write
-    with open(path, "wb") as f:
-        f.write(file_contents.encode(CODEC))
+    write_file_bytes(path, file_contents.encode(CODEC))
 
 
 def write_file_bytes(path: str, content: bytes):
     # create the parent folder if it did not exist
     mk_parent_dir(path)
 
-    with open(path, "wb") as f:
+    # Write a new file and replace the old one, so that hard links to the template are not modified
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
         f.write(content)
+    os.replace(tmp_path, path)
 
 
 def read_file_bytes(path: str) -> bytes:
@@ -80,18 +134,28 @@ def read_file_bytes(path: str) -> bytes:
         return f.read()
 
 
-def confirm_or_exit():
+def ask_to_continue() -> bool:
     choice = input("Do you want to continue? [y/N]\n")
-    if not choice.lower().startswith("y"):
-        print("Aborted")
-        sys.exit(0)
+    return choice.lower().startswith("y")
 
 
 def parse_yaml_file(path: str):
+    # Imported here, so that starting the CLI does not need to load it
+    import yaml
     yamlText = read_file_bytes(path).decode(CODEC)
     return yaml.safe_load(yamlText)
 
 
+def get_custom_hooks(config: dict) -> List[str]:
+    # The project's own hooks. They get <PROJECT>, so they may read any file of the project
+    hooks = []
+    for field in HOOK_FIELDS:
+        for command in config.get(field) or []:
+            if not str(command).strip().startswith(TEMPLATE_TOOLS_PREFIX):
+                hooks.append(str(command))
+    return hooks
+
+
 def list_files(dir_path: str) -> List[str]:
     file_list: List[str] = []
     for root, _dirs, files in os.walk(dir_path):
@@ -0,0 +1,274 @@
+# Watch mode: keeps running, and rebuilds + applies the template whenever the template or
+# the project's config files change.
+# The result of pre_build (which runs the slow plugin scripts) is kept in a snapshot folder.
+# Changes to the project config or the template tools invalidate it, but changes to the files in
+# template/public are just linked into it. Every rebuild starts from a (hard linked) copy of the
+# snapshot, so only build, post_build and apply run again. They still process all files: every liquid file
+# is rendered again (only parsing it is cached) and all post_build steps run. Only the SASS compiler skips
+# unchanged stylesheets, if the cache is enabled. The affected outputs are only logged.
+# pylint: disable=wildcard-import, unused-wildcard-import
+from utils import *
+from pre_build import pre_build, CACHE_FOLDER_NAMES
+from build import build
+from post_build import post_build
+from apply import apply_changes, get_changed_files, list_changes
+from cache import PROJECT_INPUT_FILES
+import sass_deps
+import select
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+# Files in this folder of the template are not modified by pre_build, all others may be inputs of it
+PUBLIC_FOLDER_NAME = "public"
+LIQUID_FILE_EXTENSION = ".liquid"
+# Editors often write a file in multiple steps. Wait until there are no new events for this long
+DEBOUNCE_SECONDS = 0.05
+POLL_INTERVAL_SECONDS = 0.5
+# Temporary files of editors and of our own atomic writes
+IGNORED_FILE_SUFFIXES = ["~", ".swp", ".swx", ".swo"]
+IGNORED_FILE_PREFIXES = [".#"]
+IGNORED_FILE_NAMES = ["4913"]  # vim checks, if it can create files in the folder
+
+# See "man inotify"
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len, char name[len]
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def is_ignored_path(path: str) -> bool:
+    name = os.path.basename(path)
+    if name in IGNORED_FILE_NAMES or ".tmp-" in name:
+        return True
+    if any(name.endswith(suffix) for suffix in IGNORED_FILE_SUFFIXES):
+        return True
+    if any(name.startswith(prefix) for prefix in IGNORED_FILE_PREFIXES):
+        return True
+    return any(part in CACHE_FOLDER_NAMES for part in path.split(os.sep))
+
+
+class InotifyWatcher:
+    # Linux only. Folders are watched recursively, files by watching their parent folder
+    def __init__(self, folders: List[str], files: List[str]):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> (folder, whether new subfolders should be watched too)
+        self.watches: Dict[int, Tuple[str, bool]] = {}
+        self.files = set(files)
+        for folder in folders:
+            self.add_folder(folder, True)
+        for folder in {os.path.dirname(path) for path in files}:
+            self.add_folder(folder, False)
+
+    def add_folder(self, folder: str, recursive: bool):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), INOTIFY_MASK)
+        if wd < 0:
+            log(f"[WARN] Can not watch '{folder}'")
+            return
+        self.watches[wd] = (folder, recursive)
+        if recursive:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and entry.name not in CACHE_FOLDER_NAMES:
+                        self.add_folder(entry.path, True)
+
+    def read_events(self, timeout: Optional[float]) -> Set[str]:
+        changed: Set[str] = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so treat every watched folder as changed
+                changed.update(folder for folder, _ in self.watches.values())
+                continue
+            if wd not in self.watches:
+                continue
+            folder, recursive = self.watches[wd]
+            path = os.path.join(folder, os.fsdecode(name))
+            if not recursive and path not in self.files:
+                continue
+            if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_folder(path, True)
+            changed.add(path)
+        return changed
+
+    def wait_for_changes(self) -> Set[str]:
+        changed: Set[str] = set()
+        while True:
+            # Block until the first event, then collect events until it is quiet
+            new_changes = self.read_events(DEBOUNCE_SECONDS if changed else None)
+            if not new_changes and changed:
+                return changed
+            changed.update(path for path in new_changes if not is_ignored_path(path))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Fallback for systems without inotify. Compares the modification times of all files
+    def __init__(self, folders: List[str], files: List[str]):
+        self.folders = folders
+        self.files = files
+        self.state = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        state: Dict[str, Tuple[int, int]] = {}
+        paths = list(self.files)
+        for folder in self.folders:
+            paths += [path for path in list_files(folder) if not is_ignored_path(path)]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        return state
+
+    def wait_for_changes(self) -> Set[str]:
+        while True:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            new_state = self.scan()
+            changed = {path for path in set(self.state) | set(new_state)
+                       if self.state.get(path) != new_state.get(path)}
+            self.state = new_state
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(folders: List[str], files: List[str]):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders, files)
+        except (OSError, AttributeError) as e:
+            print(f"[WARN] inotify is not available ({e}), checking for changes every {POLL_INTERVAL_SECONDS}s")
+    return PollingWatcher(folders, files)
+
+
+def needs_pre_build(settings: Settings, changed_paths: Set[str]) -> bool:
+    # Only files in template/public are never read by pre_build plugins
+    public_dir = os.path.join(settings.template_dir, PUBLIC_FOLDER_NAME)
+    return any(os.path.commonpath([public_dir, path]) != public_dir for path in changed_paths)
+
+
+def get_affected_outputs(settings: Settings, changed_paths: Set[str], last_build_dir: str,
+                         dependency_graph: Dict[str, List[str]]) -> List[str]:
+    # Maps changed template files to the files in the build output, that will be different
+    outputs = set()
+    for path in changed_paths:
+        rel_path = os.path.relpath(path, settings.template_dir)
+        if rel_path.endswith(LIQUID_FILE_EXTENSION):
+            rel_path = rel_path[:-len(LIQUID_FILE_EXTENSION)]
+        if rel_path.endswith((".scss", ".sass")):
+            # Partials are not part of the output, but all stylesheets importing them are
+            build_path = os.path.join(last_build_dir, rel_path)
+            for output in sass_deps.get_outputs_depending_on(dependency_graph, build_path):
+                outputs.add(os.path.relpath(output, last_build_dir))
+        else:
+            outputs.add(rel_path)
+    return sorted(outputs)
+
+
+def drop_temporary_files(settings: Settings, snapshot_dir: str, changed_paths: Set[str]) -> Set[str]:
+    # Files that were created and deleted again since the last build (for example by "sed -i")
+    def is_relevant(path: str) -> bool:
+        if os.path.lexists(path) or os.path.commonpath([settings.template_dir, path]) != settings.template_dir:
+            return True
+        return os.path.lexists(os.path.join(snapshot_dir, os.path.relpath(path, settings.template_dir)))
+    return {path for path in changed_paths if is_relevant(path)}
+
+
+def sync_snapshot(settings: Settings, snapshot_dir: str, changed_paths: Set[str]):
+    # Links the current versions of the changed template files into the snapshot
+    for path in sorted(changed_paths):
+        dst = os.path.join(snapshot_dir, os.path.relpath(path, settings.template_dir))
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            rm_folder(dst)
+        elif os.path.lexists(dst):
+            os.remove(dst)
+
+        if os.path.isdir(path):
+            shutil.copytree(path, dst, copy_function=link_or_copy,
+                            ignore=shutil.ignore_patterns(*CACHE_FOLDER_NAMES))
+        elif os.path.isfile(path):
+            mk_parent_dir(dst)
+            link_or_copy(path, dst)
+
+
+def rebuild(settings: Settings, snapshot_dir: str) -> Tuple[dict, str, Dict[str, List[str]]]:
+    # Returns the applied changes, the (already deleted) build dir and the SASS dependency graph,
+    # whose paths refer to that build dir
+    with build_workspace(settings) as build_settings:
+        shutil.copytree(snapshot_dir, build_settings.build_dir,
+                        copy_function=link_or_copy, dirs_exist_ok=True)
+        dependency_graph = build(build_settings)
+        post_build(build_settings)
+        # Reached only if the build did not raise BuildError
+        changes = get_changed_files(build_settings, build_complete=True)
+        apply_changes(build_settings, changes)
+    return changes, build_settings.build_dir, dependency_graph
+
+
+def watch_project(settings: Settings):
+    # Runs until interrupted. Changes are applied without asking for confirmation
+    project_dir = os.path.abspath(settings.project_dir)
+    project_files = [os.path.join(project_dir, name) for name in PROJECT_INPUT_FILES]
+    watcher = create_watcher([settings.template_dir], project_files)
+    try:
+        with build_workspace(settings) as snapshot_settings:
+            snapshot_dir = snapshot_settings.build_dir
+            snapshot_is_valid = False
+            changed_paths: Set[str] = set()
+            last_build_dir = ""
+            dependency_graph: Dict[str, List[str]] = {}
+            while True:
+                start_time = time.monotonic()
+                try:
+                    if not snapshot_is_valid or needs_pre_build(settings, changed_paths):
+                        snapshot_is_valid = False
+                        log("Running pre_build")
+                        pre_build(snapshot_settings)
+                        snapshot_is_valid = True
+                    else:
+                        sync_snapshot(settings, snapshot_dir, changed_paths)
+                        if last_build_dir:
+                            affected = get_affected_outputs(settings, changed_paths, last_build_dir, dependency_graph)
+                            # Only informational, the whole build runs again
+                            log(f"Affected outputs: {', '.join(affected) or '-'}")
+                    changes, last_build_dir, dependency_graph = rebuild(settings, snapshot_dir)
+                    list_changes(changes)
+                    elapsed_ms = (time.monotonic() - start_time) * 1000
+                    print(f"[INFO] Rebuilt in {elapsed_ms:.0f} ms, {len(changes)} file(s) changed")
+                except Exception as e:
+                    # Half edited files (like invalid YAML or liquid syntax) are common while watching
+                    print(f"[ERROR] Build failed: {type(e).__name__}: {e}")
+
+                print("[INFO] Waiting for changes (press Ctrl+C to stop)")
+                changed_paths = drop_temporary_files(settings, snapshot_dir, watcher.wait_for_changes())
+                while not changed_paths:
+                    changed_paths = drop_temporary_files(settings, snapshot_dir, watcher.wait_for_changes())
+                for path in sorted(changed_paths):
+                    log(f"Changed: {path}")
+    finally:
+        watcher.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# ================== compress.py =====================
+# Writes precompressed variants (file.gz and file.br) of text files, so that static file servers
+# do not need to compress them on every request.
+# Hook type: post_build (after minify)
+# Configuration: disabled by default, enable it with "template-tools/defaults.py <PROJECT> --compress".
+#  Options: [dir] (default: the current working dir) -m <min size in bytes>
+#  (defaults.py treats arguments starting with "--" as plugin names, so use the short options there)
+# HTML files that still contain %PUBLIC_URL% are skipped: Create React App processes them (into build/index.html),
+# but would copy the compressed variants as they are, so a server would send the unprocessed template.
+#
+# The variants are cached by the hash of the input, since maximum compression is slow.
+# Variants that are not smaller than the original are not written.
+# Brotli is only used, if the "brotli" package is installed (pip install brotli).
+
+import argparse
+import gzip
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+CODEC = "utf-8"
+# Set by the template tool. Empty means, that caching is disabled (--no-cache)
+CACHE_DIR_ENV_VAR = "REACT_TEMPLATE_CACHE_DIR"
+# @SYNC with: ../../src/utils.py CACHE_DIR
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "react-template")
+# Bump this to invalidate all existing cache entries
+CACHE_FORMAT_VERSION = "1"
+# Only the newest entries are kept
+MAX_CACHE_ENTRIES = 2000
+# Small files do not get much smaller, and the response headers are bigger than the savings
+DEFAULT_MIN_SIZE = 1024
+COMPRESSIBLE_EXTENSIONS = [".html", ".htm", ".css", ".js", ".json", ".svg", ".txt", ".xml", ".map"]
+# Marks templates that are processed by Create React App
+PUBLIC_URL_PLACEHOLDER = b"%PUBLIC_URL%"
+
+
+def compress_gzip(data: bytes) -> bytes:
+    # mtime=0 makes the output reproducible
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def get_compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    # file extension -> compression function
+    compressors = {".gz": compress_gzip}
+    try:
+        import brotli
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        print("[WARN] The brotli package is not installed, only creating .gz files")
+    return compressors
+
+
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR, DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, "compress") if cache_dir else ""
+
+
+def get_cache_key(extension: str, data: bytes) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(f"{CACHE_FORMAT_VERSION}{extension}\n".encode(CODEC))
+    hasher.update(data)
+    return hasher.hexdigest() + extension
+
+
+def write_file(path: str, content: bytes):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def compress_cached(cache_dir: str, extension: str, fn: Callable[[bytes], bytes], data: bytes) -> bytes:
+    if not cache_dir:
+        return fn(data)
+    cache_path = os.path.join(cache_dir, get_cache_key(extension, data))
+    try:
+        return read_file(cache_path)
+    except OSError:
+        pass
+    compressed = fn(data)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_file(cache_path, compressed)
+    except OSError as e:
+        print(f"[WARN] Can not write to the compression cache: {e}")
+    return compressed
+
+
+def compress_file(file_path: str, compressors: Dict[str, Callable[[bytes], bytes]], cache_dir: str) -> str:
+    data = read_file(file_path)
+    results = []
+    for extension, fn in compressors.items():
+        compressed = compress_cached(cache_dir, extension, fn, data)
+        if len(compressed) < len(data):
+            write_file(file_path + extension, compressed)
+            results.append(f"{extension[1:]}: {len(compressed)}")
+    return f"Compressed {file_path} ({len(data)} bytes -> {', '.join(results) or 'not smaller'})"
+
+
+def prune_cache(cache_dir: str):
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [entry for entry in it if entry.is_file()]
+        if len(entries) > MAX_CACHE_ENTRIES:
+            entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for entry in entries[MAX_CACHE_ENTRIES:]:
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def list_compressible_files(dir_path: str, min_size: int) -> List[str]:
+    file_list = []
+    for root, _dirs, files in os.walk(dir_path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and os.path.getsize(file_path) >= min_size:
+                if is_unprocessed_template(file_path):
+                    print(f"Not compressing {file_path}, since it still contains {PUBLIC_URL_PLACEHOLDER.decode(CODEC)}")
+                else:
+                    file_list.append(file_path)
+    return file_list
+
+
+def is_unprocessed_template(file_path: str) -> bool:
+    return file_path.lower().endswith((".html", ".htm")) and PUBLIC_URL_PLACEHOLDER in read_file(file_path)
+
+
+def process_recursive(dir_path: str, min_size: int = DEFAULT_MIN_SIZE, compressors: Optional[dict] = None):
+    compressors = compressors or get_compressors()
+    cache_dir = get_cache_dir()
+    file_list = list_compressible_files(dir_path, min_size)
+    # zlib and brotli release the GIL while compressing
+    with ThreadPoolExecutor() as executor:
+        for message in executor.map(lambda path: compress_file(path, compressors, cache_dir), file_list):
+            print(message)
+    if cache_dir:
+        prune_cache(cache_dir)
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("dir", nargs="?", default=".", help="the folder to process (default: the current working dir)")
+    ap.add_argument("-m", "--min-size", type=int, default=DEFAULT_MIN_SIZE, help=f"smaller files are not compressed (default: {DEFAULT_MIN_SIZE} bytes)")
+    args = ap.parse_args(argv)
+
+    process_recursive(args.dir, args.min_size)
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py, which runs the plugin in-process
+    main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,9 @@
 # Configuration:
 #  Call it with no arguments, to just use the defaults.
 #  En-/Disable plugins by passing --<plugin_name> or --no-"plugin_name" (eg --i18n or --no-i18n) options
+# The pre_build plugins run right away. The post_build plugins are run by a single command, that is injected
+# into the config. Python plugins run in this process, so they do not need to start an interpreter and parse
+# the config again.
 
 # Debugging tip: make the final pre build command print the config (like this:)
 # pre_build:
@@ -14,10 +17,16 @@
 # - cat react-template.yaml
 
 
+import importlib.util
 import os
-from typing import Callable, List, Tuple
-import sys
+import shlex
 import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 # External libs
 # pip install pyyaml
 import yaml
@@ -25,8 +34,15 @@ import yaml
 CODEC = "utf-8"
 PRE_BUILD = "PRE_BUILD"
 POST_BUILD = "POST_BUILD"
+CONFIG_PATH = "react-template.yaml"
+# The post_build plugins are run by a single command, that is injected into the config:
+# template-tools/defaults.py --post-build <PROJECT> <the same options>
+POST_BUILD_OPTION = "--post-build"
+SCRIPT_PATH = "template-tools/defaults.py"
 
-# A list of all supported plugins
+# A list of all supported plugins.
+# Python scripts that define "run(context, args)" are run in the same process (see PluginContext),
+# everything else is run as a shell command
 PLUGINS = {
     # The plugin name, used in the CLI flags
     "i18n": {
@@ -36,24 +52,65 @@ PLUGINS = {
         "cmd": "template-tools/i18n/i18n.py <PROJECT>",
         # Whether it is enabled by default
         "enabled": True,
+        # Plugins of the same stage that need to finish first. They have to be listed above this one.
+        # Plugins that do not depend on each other run at the same time
+        "after": [],
+    },
+    # The post_build parts of i18n. They do nothing if the i18n plugin is disabled
+    "i18n_compact": {
+        "stage": POST_BUILD,
+        "cmd": "template-tools/i18n/compact.py",
+        "enabled": True,
+        "after": [],
     },
+    "i18n_prerender": {
+        "stage": POST_BUILD,
+        "cmd": "template-tools/i18n/prerender.py",
+        "enabled": True,
+        "after": ["i18n_compact"],
+    },
+    # Needs to run after the i18n plugins, since they write HTML and JS files
     "minify": {
         "stage": POST_BUILD,
         "cmd": "template-tools/minify.py",
         "enabled": True,
+        "after": ["i18n_compact", "i18n_prerender"],
+    },
+    # Needs to run after minify (inlines the minified CSS) and before fingerprint
+    "inline_css": {
+        "stage": POST_BUILD,
+        "cmd": "template-tools/inline_css.py public",
+        "enabled": False,
+        "after": ["minify"],
+    },
+    # Needs to run after minify (hashes the final contents) and before compress
+    "fingerprint": {
+        "stage": POST_BUILD,
+        "cmd": "template-tools/fingerprint.py public",
+        "enabled": False,
+        "after": ["minify", "inline_css"],
+    },
+    # Needs to run after minify, so that the compressed files match the minified ones
+    "compress": {
+        "stage": POST_BUILD,
+        "cmd": "template-tools/compress.py public",
+        "enabled": False,
+        "after": ["minify", "inline_css", "fingerprint"],
     },
 }
+# Loading a module changes sys.path and sys.modules
+load_lock = threading.Lock()
 
 
-def modify_yaml_file(yaml_path: str, fn: Callable[[dict], dict]):
-    # read
-    text = read_file(yaml_path)
-    data = yaml.safe_load(text)
-    # modify
-    data = fn(data)
-    # write
-    text = yaml.safe_dump(data)
-    write_file(yaml_path, text)
+class PluginContext:
+    # Shared by the plugins of a stage. The working dir is the build dir
+    def __init__(self, project_dir: str, config: dict):
+        self.project_dir = project_dir
+        self.build_dir = os.getcwd()
+        # The parsed react-template.yaml. The changes of pre_build plugins are written once after the stage.
+        # The plugins run in parallel, so hold config_lock while using it
+        self.config = config
+        self.config_lock = threading.Lock()
 
 
 def write_file(path: str, content: str):
@@ -62,8 +119,11 @@ def write_file(path: str, content: str):
     except Exception:
         pass
 
-    with open(path, "wb") as f:
+    # write to a new file, since the old one may be a hard link to the template
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
         f.write(content.encode(CODEC))
+    os.replace(tmp_path, path)
 
 
 def read_file(path: str) -> str:
@@ -71,19 +131,23 @@ def read_file(path: str) -> str:
         return f.read().decode(CODEC)
 
 
-def parse_command_line_arguments() -> Tuple[str, dict]:
-    if len(sys.argv) < 2:
+def parse_command_line_arguments(argv: List[str]) -> Tuple[str, str, List[str], dict]:
+    stage = PRE_BUILD
+    if argv and argv[0] == POST_BUILD_OPTION:
+        stage, argv = POST_BUILD, argv[1:]
+    if not argv:
         print(f" Usage error ".center(80, "!"))
         print(f"Usage: {sys.argv[0]} <project_dir>")
         sys.exit(1)
-    project_dir = sys.argv[1]
+    project_dir = argv[0]
+    options = argv[1:]
 
-    remaining_options = [x for x in sys.argv[2:]]
+    remaining_options = list(options)
     plugin_status = {}
     for [name, data] in PLUGINS.items():
         plugin_status[name] = {
             "enabled": data["enabled"] or False,
-            "args": "",
+            "args": [],
         }
 
     while remaining_options:
@@ -92,25 +156,25 @@ def parse_command_line_arguments() -> Tuple[str, dict]:
             raise Exception(
                 f"Unsupported option '{open}', expected it to start with '--'")
 
-        arg_str = ""
+        args = []
         while remaining_options and not remaining_options[0].startswith("--"):
-            arg_str += f" {remaining_options[0]}"
+            args.append(remaining_options[0])
             remaining_options = remaining_options[1:]
 
         if option.startswith("--no-"):
             plugin_name = option[len("--no-"):]
             plugin_status[plugin_name] = {
                 "enabled": False,
-                "args": arg_str,
+                "args": args,
             }
         else:
             plugin_name = option[len("--"):]
             plugin_status[plugin_name] = {
                 "enabled": True,
-                "args": arg_str,
+                "args": args,
             }
 
-    return project_dir, plugin_status
+    return stage, project_dir, options, plugin_status
 
 
 def append_to_list_in_dict(the_dict: dict, dict_key: str, list_to_append: List):
@@ -118,40 +182,142 @@ def append_to_list_in_dict(the_dict: dict, dict_key: str, list_to_append: List):
     the_dict[dict_key] = original_list + list_to_append
 
 
-if __name__ == "__main__":
-    project_dir, plugin_status_map = parse_command_line_arguments()
+def get_command(plugin_name: str, args: List[str], project_dir: str) -> List[str]:
+    # @SYNC from: ../src/pre_build.py fn=run_commands
+    return [token.replace("<PROJECT>", project_dir) for token in shlex.split(PLUGINS[plugin_name]["cmd"]) + args]
+
+
+def load_plugin_function(script_path: str) -> Optional[Callable]:
+    # Returns the run(context, args) function of a python plugin or None, if it has to be run as a shell command
+    if not script_path.endswith(".py") or not os.path.isfile(script_path):
+        return None
+    name = os.path.splitext(os.path.basename(script_path))[0]
+    with load_lock:
+        module = sys.modules.get(name)
+        if module is None:
+            # Like for scripts, imports are searched in the script's folder (prerender.py imports i18n.py)
+            sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+            spec = importlib.util.spec_from_file_location(name, script_path)
+            module = importlib.util.module_from_spec(spec)
+            # Registered before it is executed, so that process pools (see minify.py) can find its functions
+            sys.modules[name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[name]
+                raise
+        elif os.path.realpath(getattr(module, "__file__", None) or "") != os.path.realpath(script_path):
+            # An other module with the same name was already imported
+            return None
+    return getattr(module, "run", None)
+
+
+def run_plugin(plugin_name: str, command: List[str], context: PluginContext, dependencies: List[Future]) -> bool:
+    # Returns whether the plugin succeeded
+    for dependency in dependencies:
+        dependency.result()
+    print(f" Executing: {shlex.join(command)} ".center(80, "="), flush=True)
+    start_time = time.monotonic()
+    try:
+        fn = load_plugin_function(command[0])
+        if fn:
+            fn(context, command[1:])
+        else:
+            if PLUGINS[plugin_name]["stage"] == PRE_BUILD:
+                # Shell commands may read and modify the config file, so it has to be up to date.
+                # Nothing else may change the config until the changes are read back
+                with context.config_lock:
+                    write_config(context.config)
+                    code = subprocess.call(shlex.join(command), shell=True)
+                    context.config.clear()
+                    context.config.update(read_config())
+            else:
+                # The config is only used by the build, so post_build commands do not need it
+                code = subprocess.call(shlex.join(command), shell=True)
+            if code != 0:
+                raise Exception(f"Command failed with code {code}")
+    except (Exception, SystemExit):
+        # Like before, the other plugins still run. Only its output may be missing
+        print(f"[WARN] Plugin {plugin_name} failed:")
+        traceback.print_exc()
+        return False
+    print(f"Plugin {plugin_name} finished in {time.monotonic() - start_time:.2f}s", flush=True)
+    return True
+
+
+def get_dependencies(plugin_name: str, futures: Dict[str, Future]) -> List[Future]:
+    # The order is kept if a plugin in between is disabled (like minify, but inline_css and compress are enabled)
+    dependencies = []
+    for name in PLUGINS[plugin_name].get("after", []):
+        if name in futures:
+            dependencies.append(futures[name])
+        else:
+            dependencies += get_dependencies(name, futures)
+    return dependencies
+
+
+def run_stage(plugins: List[Tuple[str, List[str]]], context: PluginContext) -> List[str]:
+    # Runs the (plugin name, command) list and returns the names of the plugins that failed.
+    # A plugin starts as soon as the enabled plugins in its "after" list finished
+    futures: Dict[str, Future] = {}
+    with ThreadPoolExecutor(max_workers=max(len(plugins), 1)) as executor:
+        for plugin_name, command in plugins:
+            dependencies = get_dependencies(plugin_name, futures)
+            futures[plugin_name] = executor.submit(run_plugin, plugin_name, command, context, dependencies)
+    return [name for name, future in futures.items() if not future.result()]
+
+
+def read_config() -> dict:
+    return yaml.safe_load(read_file(CONFIG_PATH)) or {}
+
+
+def write_config(config: dict):
+    write_file(CONFIG_PATH, yaml.safe_dump(config))
+
+
+def get_post_build_command(options: List[str]) -> str:
+    # <PROJECT> is replaced by the template tool
+    return " ".join([SCRIPT_PATH, POST_BUILD_OPTION, "<PROJECT>"] + [shlex.quote(option) for option in options])
+
+
+def main():
+    stage, project_dir, options, plugin_status_map = parse_command_line_arguments(sys.argv[1:])
+    context = PluginContext(project_dir, read_config())
+    stage_plugins = []
     pre_build_commands = []
-    post_build_commands = []
+    post_build_plugins = []
 
     for [plugin_name, plugin_status] in plugin_status_map.items():
-        if plugin_status["enabled"]:
+        plugin_data = PLUGINS[plugin_name]
+        plugin_stage = plugin_data["stage"]
+        if plugin_stage not in [PRE_BUILD, POST_BUILD]:
+            raise Exception(f"Invalid stage: '{plugin_stage}'")
+        if plugin_stage != stage:
+            if plugin_status["enabled"] and plugin_stage == POST_BUILD:
+                # Will be run by the injected command
+                post_build_plugins.append(plugin_name)
+        elif plugin_status["enabled"]:
             print(f"Plugin {plugin_name}: enabled")
-            plugin_data = PLUGINS[plugin_name]
-            stage = plugin_data["stage"]
-            cmd = plugin_data["cmd"] + plugin_status["args"]
-
-            if stage == PRE_BUILD:
-                # Run it now, since we are currently in th pre build stage
-                pre_build_commands.append(cmd)
-                # @SYNC from: ../src/pre_build.py fn=run_commands
-                command = str(cmd).replace("<PROJECT>", project_dir)
-                print(f" Executing: {command} ".center(80, "="))
-                subprocess.call(command, shell=True)
-            elif stage == POST_BUILD:
-                # Store this plugin so that we can inject it into the config later
-                post_build_commands.append(cmd)
-            else:
-                raise Exception(f"Invalid stage: '{stage}'")
+            stage_plugins.append((plugin_name, get_command(plugin_name, plugin_status["args"], project_dir)))
+            pre_build_commands.append(" ".join([plugin_data["cmd"]] + plugin_status["args"]))
         else:
             print(f"Plugin {plugin_name}: disabled")
 
-    def inject_post_build_commands(config: dict):
-        append_to_list_in_dict(config, "post_build", post_build_commands)
+    failed_plugins = run_stage(stage_plugins, context)
+
+    if stage == PRE_BUILD:
         # Not really needed, but nice for debugging
-        append_to_list_in_dict(config, "pre_build", pre_build_commands)
-        return config
+        append_to_list_in_dict(context.config, "pre_build", pre_build_commands)
+        if post_build_plugins:
+            print(f"Injecting the post build plugins into the config: {', '.join(post_build_plugins)}")
+            append_to_list_in_dict(context.config, "post_build", [get_post_build_command(options)])
+        # The config is only written once, after all plugins changed it
+        write_config(context.config)
+
+    if failed_plugins:
+        print(f"[WARN] Failed plugins: {', '.join(failed_plugins)}")
+        sys.exit(1)
 
-    if post_build_commands:
-        print(
-            f"Injecting {len(post_build_commands)} post build command(s) into the config")
-        modify_yaml_file("react-template.yaml", inject_post_build_commands)
+
+if __name__ == "__main__":
+    main()
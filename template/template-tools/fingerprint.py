@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# ================== fingerprint.py =====================
+# Renames assets to names containing a hash of their contents (like index.css -> index.3f9a1c2b.css)
+# and rewrites the references to them. The renamed files can be served with long-lived
+# "Cache-Control: immutable" headers, since a changed file always gets a new name.
+# Hook type: post_build (after minify, before compress)
+# Configuration: disabled by default, enable it with "template-tools/defaults.py <PROJECT> --fingerprint".
+#  Options: [dir] (default: the current working dir) -e .css .js ...
+#  Example: "template-tools/defaults.py <PROJECT> --fingerprint -e .css .js .json .png"
+#
+# Only files that are referenced are renamed:
+#  - "%PUBLIC_URL%/<name>" and relative URLs in the href / src attributes of HTML files
+#  - url(...) in CSS files and inlined stylesheets
+#  - the icons' "src" in manifest.json
+# The mapping from the old to the new names is written to fingerprints.json.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Set
+
+CODEC = "utf-8"
+MAPPING_FILE_NAME = "fingerprints.json"
+HASH_LENGTH = 8
+DEFAULT_EXTENSIONS = [".css", ".js", ".json"]
+# Browsers and crawlers request these by name
+NEVER_RENAME = ["favicon.ico", "robots.txt", MAPPING_FILE_NAME]
+# Pages that are not processed by create-react-app (like the ones of i18n/prerender.py) use relative URLs
+HTML_REFERENCE_PATTERN = re.compile(r"""((?:href|src)=["']?(?:%PUBLIC_URL%/)?)([^"'\s>?#]+)""")
+CSS_REFERENCE_PATTERN = re.compile(r"""(url\(\s*["']?)([^"')?#]+)""")
+MANIFEST_REFERENCE_PATTERN = re.compile(r"""("src"\s*:\s*")([^"]+)""")
+
+
+def get_reference_patterns(file_path: str) -> List[re.Pattern]:
+    name = os.path.basename(file_path)
+    if is_html_file(file_path):
+        # HTML files may contain inlined stylesheets, see inline_css.py
+        return [HTML_REFERENCE_PATTERN, CSS_REFERENCE_PATTERN]
+    elif name.endswith(".css"):
+        return [CSS_REFERENCE_PATTERN]
+    elif name == "manifest.json":
+        return [MANIFEST_REFERENCE_PATTERN]
+    else:
+        return []
+
+
+def is_html_file(file_path: str) -> bool:
+    return file_path.endswith((".html", ".htm"))
+
+
+def is_local_reference(reference: str) -> bool:
+    return not (reference.startswith(("/", "data:")) or "://" in reference)
+
+
+def get_fingerprinted_name(file_path: str, file_contents: bytes) -> str:
+    file_hash = hashlib.sha256(file_contents).hexdigest()[:HASH_LENGTH]
+    base, extension = os.path.splitext(os.path.basename(file_path))
+    return f"{base}.{file_hash}{extension}"
+
+
+def write_file(path: str, content: bytes):
+    # write to a new file, since the old one may be a hard link to the template
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Fingerprinter:
+    def __init__(self, root_dir: str, extensions: List[str]):
+        self.root_dir = root_dir
+        self.extensions = extensions
+        # rel path (relative to root_dir) -> new rel path
+        self.renamed: Dict[str, str] = {}
+        self.done: Set[str] = set()
+
+    def resolve(self, referencing_file: str, pattern: re.Pattern, reference: str) -> str:
+        # %PUBLIC_URL% references are relative to the root, the others to the file itself
+        if pattern is HTML_REFERENCE_PATTERN:
+            base_dir = self.root_dir
+        else:
+            base_dir = os.path.dirname(referencing_file)
+        return os.path.normpath(os.path.join(base_dir, reference))
+
+    def should_rename(self, file_path: str) -> bool:
+        name = os.path.basename(file_path)
+        if name in NEVER_RENAME or is_html_file(file_path):
+            return False
+        return os.path.splitext(name)[1].lower() in self.extensions and os.path.isfile(file_path)
+
+    def process(self, file_path: str) -> str:
+        # Rewrites the references in the file, renames it (if needed) and returns the new path.
+        # Referenced files are processed first, since their new names change this file's hash
+        rel_path = os.path.relpath(file_path, self.root_dir)
+        if rel_path in self.done:
+            return os.path.join(self.root_dir, self.renamed.get(rel_path, rel_path))
+        self.done.add(rel_path)
+
+        for pattern in get_reference_patterns(file_path):
+            self.rewrite_references(file_path, pattern)
+
+        if not self.should_rename(file_path):
+            return file_path
+        new_path = os.path.join(os.path.dirname(file_path), get_fingerprinted_name(file_path, read_file(file_path)))
+        os.replace(file_path, new_path)
+        self.renamed[rel_path] = os.path.relpath(new_path, self.root_dir)
+        print(f"Renamed {rel_path} -> {self.renamed[rel_path]}")
+        return new_path
+
+    def rewrite_references(self, file_path: str, pattern: re.Pattern):
+        text = read_file(file_path).decode(CODEC)
+
+        def replace_reference(match: re.Match) -> str:
+            prefix, reference = match.group(1), match.group(2).strip()
+            if not is_local_reference(reference):
+                return match.group(0)
+            referenced_path = self.resolve(file_path, pattern, reference)
+            already_renamed = os.path.relpath(referenced_path, self.root_dir) in self.renamed
+            if not already_renamed and not self.should_rename(referenced_path):
+                return match.group(0)
+            new_path = self.process(referenced_path)
+            new_reference = os.path.join(os.path.dirname(reference), os.path.basename(new_path))
+            return prefix + new_reference
+
+        new_text = pattern.sub(replace_reference, text)
+        if new_text != text:
+            write_file(file_path, new_text.encode(CODEC))
+
+
+def list_html_files(dir_path: str) -> List[str]:
+    file_list = []
+    for root, _dirs, files in os.walk(dir_path):
+        for name in sorted(files):
+            if is_html_file(name):
+                file_list.append(os.path.join(root, name))
+    return file_list
+
+
+def fingerprint(dir_path: str, extensions: List[str] = DEFAULT_EXTENSIONS) -> Dict[str, str]:
+    fingerprinter = Fingerprinter(dir_path, [e.lower() for e in extensions])
+    # The HTML files are the entry points, everything else is only renamed if it is referenced
+    for html_file in list_html_files(dir_path):
+        fingerprinter.process(html_file)
+
+    mapping_path = os.path.join(dir_path, MAPPING_FILE_NAME)
+    write_file(mapping_path, json.dumps(fingerprinter.renamed, indent=2, sort_keys=True).encode(CODEC))
+    return fingerprinter.renamed
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("dir", nargs="?", default=".", help="the folder to process (default: the current working dir)")
+    ap.add_argument("-e", "--extensions", nargs="+", default=DEFAULT_EXTENSIONS, help=f"only rename files with these extensions (default: {' '.join(DEFAULT_EXTENSIONS)})")
+    args = ap.parse_args(argv)
+
+    fingerprint(args.dir, args.extensions)
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py, which runs the plugin in-process
+    main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# ================== compact.py =====================
+# Checks the translations against the built page:
+#  - translations for element ids that are not in the built pages are reported. They are only dropped, if
+#    "drop_unused_translations: true" is set in the project's i18n.yaml, since the elements may be created
+#    later by JavaScript (for example by React)
+#  - the translations that are missing for some languages are reported
+# The texts are stored in compact JSON and repeated texts only once (see i18n.py encode_translations).
+# Hook type: post_build (added by i18n.py or defaults.py, runs before prerender.py and the other post_build steps)
+# Configuration: set "drop_unused_translations: true" in the project's i18n.yaml. Otherwise the browser
+#  downloads the unused translations and looks for the elements on every language change.
+
+import os
+from html.parser import HTMLParser
+from typing import Dict, List, Set
+# Reuse the config handling of the pre_build step
+from i18n import CHUNK_URL, DEFAULT_LANG, DROP_UNUSED_FIELD, JS_OUTPUT_NAME, MISSING_TRANSLATION, \
+    RESOLVED_CONFIG_PATH, SPLIT_LANGUAGES_FIELD, create_i18n_js, get_translation_languages, load_resolved_config, \
+    write_resolved_config
+
+PUBLIC_DIR = "public"
+
+
+class IdCollector(HTMLParser):
+    # Collects the ids of all elements
+    def __init__(self, text: str):
+        super().__init__(convert_charrefs=True)
+        self.ids: Set[str] = set()
+        self.feed(text)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name == "id" and value:
+                self.ids.add(value)
+
+
+def get_page_ids(dir_path: str) -> Set[str]:
+    # Only the top level HTML files are pages of the website
+    ids = set()
+    for name in sorted(os.listdir(dir_path)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(dir_path, name), "rb") as f:
+                ids.update(IdCollector(f.read().decode("utf-8")).ids)
+    return ids
+
+
+def get_missing_languages(translations: dict, languages: List[str]) -> Dict[str, List[str]]:
+    # id -> the languages without a translation
+    missing = {}
+    for id, translations_by_lang in sorted(translations.items()):
+        missing_languages = [lang for lang in languages if not translations_by_lang.get(lang)]
+        if missing_languages:
+            missing[id] = missing_languages
+    return missing
+
+
+def get_chunk_path(lang: str) -> str:
+    return os.path.join(PUBLIC_DIR, CHUNK_URL.replace("{lang}", lang))
+
+
+def get_payload_size(i18n_config: dict) -> int:
+    # The size of everything that the browser may download
+    paths = [os.path.join(PUBLIC_DIR, JS_OUTPUT_NAME)]
+    if i18n_config.get(SPLIT_LANGUAGES_FIELD, False):
+        paths += [get_chunk_path(lang) for lang in i18n_config.get("translation_languages", [])]
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+def main():
+    i18n_config = load_resolved_config()
+    translations = i18n_config.get("translations", {})
+    page_ids = get_page_ids(PUBLIC_DIR)
+    drop_unused = i18n_config.get(DROP_UNUSED_FIELD, False)
+
+    unused_ids = [id for id in sorted(translations) if id not in page_ids]
+    if unused_ids:
+        action = "removed" if drop_unused else "kept, they may be created by JavaScript"
+        print(f"No element with this id in the pages ({action}): {', '.join(unused_ids)}")
+        if drop_unused:
+            translations = {id: value for id, value in translations.items() if id in page_ids}
+
+    # The languages in the language chooser should have translations too
+    chooser_languages = [lang_obj["code"] for lang_obj in i18n_config.get("languages", [])]
+    languages = sorted(set(get_translation_languages({"translations": translations}) + chooser_languages))
+    for id, missing_languages in get_missing_languages(translations, languages).items():
+        if translations[id].get(DEFAULT_LANG):
+            fallback = f"uses the '{DEFAULT_LANG}' text"
+        else:
+            fallback = f"shows '{MISSING_TRANSLATION}'"
+        print(f"[WARN] Missing translations for {id}: {', '.join(missing_languages)} ({fallback})")
+
+    if unused_ids and drop_unused:
+        old_size = get_payload_size(i18n_config)
+        compacted_config = dict(i18n_config)
+        compacted_config["translations"] = translations
+        compacted_config["translation_languages"] = get_translation_languages(compacted_config)
+        if compacted_config.get(SPLIT_LANGUAGES_FIELD, False):
+            # Languages that only had translations for the removed ids
+            for lang in i18n_config.get("translation_languages", []):
+                if lang not in compacted_config["translation_languages"] and os.path.isfile(get_chunk_path(lang)):
+                    os.remove(get_chunk_path(lang))
+
+        # Later steps (like prerender.py) should also use the compacted translations
+        write_resolved_config(compacted_config)
+        create_i18n_js(compacted_config, ".")
+        print(f"Translations: {old_size} -> {get_payload_size(compacted_config)} bytes")
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py. Does nothing, if the i18n plugin did not run
+    if os.path.isfile(RESOLVED_CONFIG_PATH):
+        main()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,25 @@
 
 # ================== i18n.py =====================
 # It localizes website elements.
-# Hook type: pre_build (modifies config file)
+# Hook type: pre_build (modifies config file). Adds compact.py (and prerender.py) as post_build steps.
+#  When run by defaults.py, the plugin runs in-process and defaults.py schedules the post_build steps.
 # Configuration:
 #  Create a i18n.yaml file in your project root. Look at i18n.yaml and i18n.example.yaml
 #  to get a feel for the structure.
 #  Add the correct id to every element (via react-template.yaml)
+#  Set "split_languages: true" in i18n.yaml to write each language to a separate file
+#  (public/i18n/<code>.json). The browser then only downloads the language it shows.
+#  Set "prerender: true" in i18n.yaml to create a page with the translations already filled in for every
+#  language (see prerender.py).
+#  Translations for ids that are not in the built page are reported by compact.py. Set
+#  "drop_unused_translations: true" in i18n.yaml to remove them, if no elements are created later (for example by React).
 
 import json
 import os
 import sys
 import shutil
+from collections import Counter
+from typing import List
 # External libs
 # pip install pyyaml
 import yaml
@@ -25,6 +34,18 @@ CONFIG_PATH = "react-template.yaml"
 CUSTOM_HTML_HEAD_FIELD = "customHtmlHead"
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 LANGUAGE_CHOOSER_DOM_FIELD = "language_chooser_dom"
+SPLIT_LANGUAGES_FIELD = "split_languages"
+PRERENDER_FIELD = "prerender"
+DROP_UNUSED_FIELD = "drop_unused_translations"
+# The merged config, with everything that post_build steps (like prerender.py) need
+RESOLVED_CONFIG_PATH = "template-tools/i18n/i18n.resolved.json"
+PRERENDER_COMMAND = "template-tools/i18n/prerender.py"
+COMPACT_COMMAND = "template-tools/i18n/compact.py"
+# Relative to the URL of i18n.js. {lang} is replaced with the language code
+CHUNK_URL = "i18n/{lang}.json"
+# @SYNC with: i18n_temlate.js DEFAULT_LANG, MISSING_TRANSLATION
+DEFAULT_LANG = "en"
+MISSING_TRANSLATION = "<Missing translation>"
 
 
 def load_config(project_dir: str) -> dict:
@@ -58,6 +79,8 @@ def load_config(project_dir: str) -> dict:
                 elif key == "languages":
                     # Overwrite language list
                     merged_data[key] = data
+                elif key in [SPLIT_LANGUAGES_FIELD, PRERENDER_FIELD, DROP_UNUSED_FIELD]:
+                    merged_data[key] = data
                 elif key == "translations":
                     # Merge translations dict
                     translations = template_data.get(key, {})
@@ -73,27 +96,91 @@ def load_config(project_dir: str) -> dict:
         return merged_data
 
 
-def create_i18n_js(i18n_config: dict, project_dir: str):
-    translations = i18n_config.get("translations", {})
-
+def get_translation_languages(i18n_config: dict) -> List[str]:
+    # All languages that have at least one translation
     languages = set()
-    for translation_dict in translations.values():
+    for translation_dict in i18n_config.get("translations", {}).values():
         languages.update(translation_dict.keys())
+    return list(sorted(languages))
+
+
+def get_page_name(lang: str) -> str:
+    # The name of the prerendered page for the language. index.html itself shows the default language
+    return "index.html" if lang == DEFAULT_LANG else f"index.{lang}.html"
+
+
+def create_i18n_js(i18n_config: dict, project_dir: str):
+    translations = i18n_config.get("translations", {})
+    languages = get_translation_languages(i18n_config)
 
     js_data = {
-        "languages": list(sorted(languages)),
-        "translations": translations,
+        "languages": languages,
     }
+    if i18n_config.get(PRERENDER_FIELD, False):
+        # lang -> page. The runtime switches languages by opening the page
+        js_data["pages"] = {lang: get_page_name(lang) for lang in languages}
+    if i18n_config.get(SPLIT_LANGUAGES_FIELD, False):
+        # The fallbacks are resolved here, so that the browser only needs a single file
+        for lang in languages:
+            chunk = {id: get_translation(translations_by_lang, lang)
+                     for id, translations_by_lang in translations.items()}
+            chunk_path = "public/" + CHUNK_URL.replace("{lang}", lang)
+            write_file_bytes(chunk_path, encode_json(chunk).encode(CODEC))
+        js_data["chunk_url"] = CHUNK_URL
+    else:
+        js_data.update(encode_translations(translations))
 
     # Inject the data into the file
     js_output_path = "public/"+JS_OUTPUT_NAME
     inject_data_into_js_file(js_data, JS_INPUT_PATH, js_output_path)
 
 
+def encode_translations(translations: dict) -> dict:
+    # Texts that are used multiple times (like the same label on different elements or untranslated texts)
+    # can be stored once in a string table. The translations then contain the index in the table.
+    # @SYNC with: i18n_temlate.js getString
+    plain = {"translations": translations}
+    counts = Counter(text for translations_by_lang in translations.values() for text in translations_by_lang.values())
+    if not counts or max(counts.values()) < 2:
+        return plain
+
+    # Frequent strings get the short indices
+    strings = sorted(counts, key=lambda text: (-counts[text], str(text)))
+    index_by_string = {text: index for index, text in enumerate(strings)}
+    table = {
+        "strings": strings,
+        "translations": {id: {lang: index_by_string[text] for lang, text in translations_by_lang.items()}
+                         for id, translations_by_lang in translations.items()},
+    }
+    # Only use the table, if it actually saves space
+    return table if len(encode_json(table)) < len(encode_json(plain)) else plain
+
+
+def encode_json(data) -> str:
+    # Sorting them forces them in a deterministic order. Same input -> same output
+    return json.dumps(data, sort_keys=True, separators=(",", ":"))
+
+
+def write_resolved_config(i18n_config: dict):
+    resolved_config = dict(i18n_config)
+    resolved_config["translation_languages"] = get_translation_languages(i18n_config)
+    text = json.dumps(resolved_config, indent=2, sort_keys=True)
+    write_file_bytes(RESOLVED_CONFIG_PATH, text.encode(CODEC))
+
+
+def load_resolved_config() -> dict:
+    # Used by the post_build steps
+    return json.loads(read_file_bytes(RESOLVED_CONFIG_PATH).decode(CODEC))
+
+
+def get_translation(translations_by_lang: dict, lang: str) -> str:
+    # @SYNC with: i18n_temlate.js loadTranslations
+    return translations_by_lang.get(lang) or translations_by_lang.get(DEFAULT_LANG) or MISSING_TRANSLATION
+
+
 def inject_data_into_js_file(data, js_input_file: str, js_output_file: str):
     text = read_file_bytes(js_input_file).decode(CODEC)
-    # Sorting them forces them in a deterministic order. Same input -> same output
-    json_string = json.dumps(data, sort_keys=True)
+    json_string = encode_json(data)
     new_text = text.replace(DATA_PLACEHOLDER, json_string)
     if new_text == text:
         raise Exception("JS input template has no placeholder for the data")
@@ -103,7 +190,20 @@ def inject_data_into_js_file(data, js_input_file: str, js_output_file: str):
 def inject_script_url_into_config(i18n_config: dict, project_dir: str):
     yaml_path = os.path.join(project_dir, CONFIG_PATH)
     config = parse_yaml_file(yaml_path)
+    update_config(config, i18n_config)
+
+    # They need to run before the other post_build steps (like minify).
+    # The translations are compacted first, so that the prerendered pages use the same ones
+    i18n_commands = [COMPACT_COMMAND]
+    if i18n_config.get(PRERENDER_FIELD, False):
+        i18n_commands.append(PRERENDER_COMMAND)
+    config["post_build"] = i18n_commands + config.get("post_build", [])
+
+    text = yaml.safe_dump(config)
+    write_file_bytes(CONFIG_PATH, text.encode(CODEC))
+
 
+def update_config(config: dict, i18n_config: dict):
     # Inject script tag to load i18n.js
     script_tag = f'<script src="%PUBLIC_URL%/{JS_OUTPUT_NAME}"></script>'
     custom_html_head = config.get(CUSTOM_HTML_HEAD_FIELD, "")
@@ -134,9 +234,6 @@ def inject_script_url_into_config(i18n_config: dict, project_dir: str):
 
     config[CUSTOM_HTML_HEAD_FIELD] = custom_html_head
 
-    text = yaml.safe_dump(config)
-    write_file_bytes(CONFIG_PATH, text.encode(CODEC))
-
 
 def parse_yaml_file(yamlPath: str):
     yamlText = read_file_bytes(yamlPath).decode(CODEC)
@@ -149,8 +246,11 @@ def write_file_bytes(path: str, content: bytes):
     except Exception:
         pass
 
-    with open(path, "wb") as f:
+    # write to a new file, since the old one may be a hard link to the template
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
         f.write(content)
+    os.replace(tmp_path, path)
 
 
 def read_file_bytes(path: str) -> bytes:
@@ -158,6 +258,17 @@ def read_file_bytes(path: str) -> bytes:
         return f.read()
 
 
+def run(context, args: List[str]):
+    # Called by defaults.py, which passes the parsed config and runs compact.py / prerender.py itself
+    project_dir = args[0] if args else context.project_dir
+    i18n_config = load_config(project_dir)
+    write_resolved_config(i18n_config)
+    create_i18n_js(i18n_config, project_dir)
+    # Other plugins may use the config at the same time
+    with context.config_lock:
+        update_config(context.config, i18n_config)
+
+
 def main():
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} <react_project_folder>")
@@ -167,6 +278,7 @@ def main():
     i18n_config = load_config(project_dir)
 
     # Do the important parts here
+    write_resolved_config(i18n_config)
     create_i18n_js(i18n_config, project_dir)
     inject_script_url_into_config(i18n_config, project_dir)
 
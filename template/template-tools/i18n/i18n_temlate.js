@@ -1,8 +1,27 @@
 const i18n_script = () => {
+    // @SYNC with: i18n.py DEFAULT_LANG, MISSING_TRANSLATION
     const DEFAULT_LANG = "en";
+    const MISSING_TRANSLATION = "<Missing translation>";
     const DATA = __I18N_JSON__;
     const LANGUAGES = DATA["languages"];
+    // Either all translations are included, or each language is in a separate file (split_languages)
     const TRANSLATIONS = DATA["translations"];
+    // If set, TRANSLATIONS contains indices in this list instead of the texts (see i18n.py encode_translations)
+    const STRINGS = DATA["strings"];
+    const CHUNK_URL = DATA["chunk_url"];
+    // lang -> page, if every language has a prerendered page (see prerender.py)
+    const PAGES = DATA["pages"];
+    // The language that this page was prerendered in, if any
+    const PAGE_LANG = document.documentElement.getAttribute("data-i18n-lang");
+    // Chunk and page URLs are relative to this script (the public URL), not to the route of the app.
+    // currentScript is only set while the script first runs
+    const SCRIPT_URL = document.currentScript ? document.currentScript.src : window.location.href;
+    const LANGUAGE_CHOOSER_ID = "page-language-chooser";
+    // Dispatched on window after a language was applied. event.detail.lang is the new language
+    const LANGUAGE_CHANGE_EVENT = "i18n:languagechange";
+    // How long missing elements are watched for after the page loaded. Elements that are rendered later
+    // (or never, like unused translations) need i18n.refresh(), so the page does not do work on every DOM change
+    const WATCH_AFTER_LOAD_MS = 2000;
 
     console.debug("Language data:", DATA);
 
@@ -15,9 +34,9 @@ const i18n_script = () => {
         console.debug("Preferred languages:", preferred_list);
         console.debug("Translation languages:", LANGUAGES);
 
-        for (lang of preferred_list) {
+        for (const lang of preferred_list) {
             // convert something like "en-US" to "en"
-            short_lang = lang.substr(0, 2);
+            const short_lang = lang.substr(0, 2);
             if (LANGUAGES.includes(short_lang)) {
                 console.log(`Selected language "${short_lang}" because it matched "${lang}"`);
                 return short_lang;
@@ -28,65 +47,130 @@ const i18n_script = () => {
         return DEFAULT_LANG;
     }
 
-    const applyLang = (lang) => {
-        console.log(`Applying language: ${lang}`);
-        if (LANGUAGES.includes(lang)) {
-            for (const [id, translations] of Object.entries(TRANSLATIONS)) {
-                elem = document.getElementById(id);
-                if (elem) {
-                    let translation = "<ERROR>";
-                    try {
-                        translation = translations[lang] || translations[DEFAULT_LANG] || "<Missing translation>";
-                        console.debug(`Translation for "${id}" is "${translation}"`);
-                    } catch (e) {
-                        console.warn(e);
-                    }
+    const getString = (value) => {
+        // @SYNC with: i18n.py encode_translations
+        return STRINGS && value !== undefined ? STRINGS[value] : value;
+    }
+
+    // lang -> Promise, that resolves to an object mapping element ids to the translations
+    const loaded_languages = new Map();
 
-                    elem.innerHTML = translation;
-                    if (id === "page-title") {
-                        // Set the window title and make the page-title element resizeable again
-                        document.title = translation;
-                        try {
-                            textFit(document.getElementById(id));
-                        } catch (error) {
-                            console.warn("Could not make title auto resizeable");
-                        }
+    const loadTranslations = (lang) => {
+        if (!loaded_languages.has(lang)) {
+            let promise;
+            if (!LANGUAGES.includes(lang)) {
+                promise = Promise.resolve({});
+            } else if (CHUNK_URL) {
+                const url = new URL(CHUNK_URL.replace("{lang}", lang), SCRIPT_URL);
+                promise = fetch(url).then((response) => {
+                    if (!response.ok) {
+                        throw new Error(`Loading ${url} failed with status ${response.status}`);
                     }
-                } else {
-                    console.log(`Element "${id}" does not exist`);
+                    return response.json();
+                });
+                // Allow retrying it later
+                promise.catch(() => loaded_languages.delete(lang));
+            } else {
+                const translations = {};
+                for (const [id, translations_by_lang] of Object.entries(TRANSLATIONS)) {
+                    translations[id] = getString(translations_by_lang[lang]) || getString(translations_by_lang[DEFAULT_LANG]) || MISSING_TRANSLATION;
+                }
+                promise = Promise.resolve(translations);
+            }
+            loaded_languages.set(lang, promise);
+        }
+        return loaded_languages.get(lang);
+    }
+
+    // id -> element. Elements are looked up once, and again if they were removed from the page
+    const element_cache = new Map();
+    // id -> the translation that was written into the element
+    const written_translations = new Map();
+    // Ids of translated elements that are not on the page (yet). React 18 renders asynchronously,
+    // so they are translated as soon as they are added while the page is loading
+    const missing_ids = new Set();
+    let observer = null;
+    let watching_stopped = false;
+    // The language that the elements on the page show
+    let applied_lang = PAGE_LANG || "";
+
+    const getElement = (id) => {
+        let elem = element_cache.get(id);
+        if (!elem || !elem.isConnected) {
+            elem = document.getElementById(id);
+            element_cache.set(id, elem);
+            written_translations.delete(id);
+        }
+        return elem;
+    }
+
+    const applyLang = (lang, translations) => {
+        console.log(`Applying language: ${lang}`);
+        // Read everything first and write afterwards, so that the browser only needs to layout once
+        const writes = [];
+        missing_ids.clear();
+        for (const [id, translation] of Object.entries(translations)) {
+            const elem = getElement(id);
+            if (elem) {
+                if (written_translations.get(id) !== translation) {
+                    writes.push([id, elem, translation]);
+                }
+            } else {
+                console.debug(`Element "${id}" does not exist`);
+                missing_ids.add(id);
+            }
+        }
+
+        for (const [id, elem, translation] of writes) {
+            elem.innerHTML = translation;
+            written_translations.set(id, translation);
+            if (id === "page-title") {
+                // Set the window title and make the page-title element resizeable again
+                document.title = translation;
+                try {
+                    textFit(elem);
+                } catch (error) {
+                    console.warn("Could not make title auto resizeable");
                 }
             }
         }
 
         // Update the language chooser, if it exists
-        lang_chooser = document.getElementById("page-language-chooser");
+        const lang_chooser = getElement(LANGUAGE_CHOOSER_ID);
         if (lang_chooser) {
             lang_chooser.value = lang;
         }
+        if (lang !== applied_lang) {
+            applied_lang = lang;
+            window.dispatchEvent(new CustomEvent(LANGUAGE_CHANGE_EVENT, { detail: { lang } }));
+        }
+        watchMissingElements();
     }
 
-    const getLang = () => {
-        const params = new URLSearchParams(window.location.search);
-        let lang = params.get("lang");
-        if (!lang) {
-            console.log("No language set in URL, checking for preferred language");
-            lang = getPreferredLanguage();
+    const watchMissingElements = () => {
+        if (missing_ids.size && !observer && !watching_stopped && window.MutationObserver) {
+            observer = new MutationObserver(() => scheduleApply());
+            observer.observe(document.body || document.documentElement, { childList: true, subtree: true });
+        } else if (!missing_ids.size && observer) {
+            // Every element exists now
+            observer.disconnect();
+            observer = null;
         }
-        return lang;
     }
 
-
-    let old_lang = "";
-
-    const updateLang = () => {
-        const lang = getLang();
-        if (lang !== old_lang) {
-            old_lang = lang;
-            setUrlLanguageParam(lang);
-            applyLang(lang);
+    const stopWatchingMissingElements = () => {
+        watching_stopped = true;
+        if (observer) {
+            observer.disconnect();
+            observer = null;
         }
     }
 
+    const getLangFromUrl = () => {
+        const params = new URLSearchParams(window.location.search);
+        return params.get("lang");
+    }
+
     const setUrlLanguageParam = (lang) => {
         const old_url = window.location.href;
 
@@ -96,22 +180,127 @@ const i18n_script = () => {
 
         if (old_url !== new_url) {
             console.log(`Updated URL: "${old_url}" -> "${new_url}"`);
-            window.history.replaceState({}, "", new_url);
+            window.history.replaceState(window.history.state, "", new_url);
         }
     }
 
-    window.addEventListener("load", () => {
-        // Repeatedly check url lang, and update elements if it changes
-        setInterval(updateLang, 100);
+    let current_lang = "";
+    let pending_frame = 0;
 
-        // If the language changer exists, make it change the "lang" param in the URL
-        lang_chooser = document.getElementById("page-language-chooser");
-        if (lang_chooser) {
-            lang_chooser.addEventListener("change", (e) => {
-                setUrlLanguageParam(e.target.value);
-            })
+    const scheduleApply = () => {
+        // Multiple changes in the same frame only cause a single update
+        if (!pending_frame) {
+            pending_frame = window.requestAnimationFrame(() => {
+                pending_frame = 0;
+                loadTranslations(current_lang).then((translations) => applyLang(current_lang, translations));
+            });
         }
-    })
+    }
+
+    const openPage = (lang) => {
+        // Keeps the other URL parameters and the hash
+        const url = new URL(PAGES[lang], SCRIPT_URL);
+        url.search = window.location.search;
+        url.searchParams.set("lang", lang);
+        url.hash = window.location.hash;
+        console.log(`Opening the page for language "${lang}": ${url}`);
+        window.location.replace(url.toString());
+    }
+
+    // Only an explicit choice of the user opens a prerendered page. Otherwise the page is translated in place,
+    // since only index.html contains the scripts of the app
+    const setLanguage = (lang, immediately, open_page) => {
+        if (open_page && PAGES && PAGES[lang] && lang !== PAGE_LANG) {
+            openPage(lang);
+            return;
+        }
+        setUrlLanguageParam(lang);
+        if (lang === current_lang && !immediately) {
+            return;
+        }
+        current_lang = lang;
+        loadTranslations(lang).then((translations) => {
+            if (lang !== current_lang) {
+                // The language was changed again, while the translations were loading
+                return;
+            }
+            if (immediately) {
+                applyLang(lang, translations);
+            } else {
+                scheduleApply();
+            }
+        }).catch((error) => console.warn(`Could not load the translations for "${lang}":`, error));
+    }
+
+    // Called after the URL may have changed (history navigation or a route change of the app)
+    const updateLangFromUrl = () => {
+        setLanguage(getLangFromUrl() || current_lang || getPreferredLanguage());
+    }
+
+    // For single page apps: call i18n.refresh() after rendering new elements or changing the route
+    window.i18n = {
+        languages: LANGUAGES,
+        getLanguage: () => current_lang,
+        setLanguage: (lang) => setLanguage(lang, false, true),
+        refresh: () => {
+            element_cache.clear();
+            written_translations.clear();
+            // Route changes may drop the "lang" parameter, so keep the current language in that case
+            setLanguage(getLangFromUrl() || current_lang || getPreferredLanguage(), true);
+        },
+    };
+
+    const initial_lang = getLangFromUrl() || getPreferredLanguage();
+    // Start loading the translations now, instead of waiting for the page to be parsed.
+    // Prerendered pages already contain them
+    if (initial_lang !== PAGE_LANG) {
+        loadTranslations(initial_lang);
+    }
+
+    const init = () => {
+        if (initial_lang === PAGE_LANG) {
+            current_lang = initial_lang;
+            setUrlLanguageParam(initial_lang);
+            // The prerendered elements already show the translations. Only the other ones (for example the ones
+            // that React creates) need them
+            loadTranslations(PAGE_LANG).then((translations) => {
+                for (const [id, translation] of Object.entries(translations)) {
+                    const elem = getElement(id);
+                    if (elem && elem.innerHTML === translation) {
+                        written_translations.set(id, translation);
+                    }
+                }
+                if (current_lang === PAGE_LANG) {
+                    applyLang(PAGE_LANG, translations);
+                }
+            }).catch((error) => console.warn(`Could not load the translations for "${PAGE_LANG}":`, error));
+        } else {
+            setLanguage(initial_lang, true);
+        }
+        if (document.readyState !== "complete") {
+            // Elements that are rendered asynchronously may only exist after the page loaded
+            window.addEventListener("load", () => {
+                scheduleApply();
+                window.setTimeout(stopWatchingMissingElements, WATCH_AFTER_LOAD_MS);
+            });
+        } else {
+            window.setTimeout(stopWatchingMissingElements, WATCH_AFTER_LOAD_MS);
+        }
+
+        window.addEventListener("popstate", updateLangFromUrl);
+        // The language chooser may be rendered later, so the events are handled on the document
+        document.addEventListener("change", (e) => {
+            if (e.target && e.target.id === LANGUAGE_CHOOSER_ID) {
+                setLanguage(e.target.value, false, true);
+            }
+        });
+    }
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", init);
+    } else {
+        init();
+    }
 };
 
 i18n_script();
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# ================== prerender.py =====================
+# Creates a page with the translations already filled in for every language, so that the first paint
+# does not need any script and is shown in the right language:
+#  - index.html: the default language
+#  - index.<lang>.html: all other languages
+# Each page gets the right <html lang> and links to the other languages (hreflang).
+# i18n.js then only needs to open the page of the selected language.
+# Hook type: post_build (added by i18n.py or defaults.py, runs after compact.py and before the other post_build steps)
+# Configuration: set "prerender: true" in the project's i18n.yaml
+# Limitation: Create React App only injects its bundles into public/index.html. The other pages are
+#  copied as they are, so they only show the static page (without the react app).
+
+import html
+import os
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+# Reuse the config handling of the pre_build step
+from i18n import CODEC, DEFAULT_LANG, PRERENDER_FIELD, RESOLVED_CONFIG_PATH, get_page_name, get_translation, \
+    load_resolved_config, read_file_bytes, write_file_bytes
+
+PUBLIC_DIR = "public"
+TEMPLATE_PAGE = "index.html"
+# The pages are not processed by create-react-app, so %PUBLIC_URL% would not be replaced
+PUBLIC_URL_PREFIX = "%PUBLIC_URL%/"
+# Marks the language that a page was prerendered in. Read by i18n.js
+PAGE_LANG_ATTRIBUTE = "data-i18n-lang"
+TITLE_ID = "page-title"
+LANGUAGE_CHOOSER_ID = "page-language-chooser"
+VOID_ELEMENTS = ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+                 "param", "source", "track", "wbr"]
+LANG_ATTRIBUTE_PATTERN = re.compile(r"""\slang=("[^"]*"|'[^']*'|[^\s>]*)""")
+
+
+class PageStructure(HTMLParser):
+    # Finds the positions of everything that the prerendering needs to change
+    def __init__(self, text: str, ids: List[str]):
+        super().__init__(convert_charrefs=True)
+        self.line_offsets = [0]
+        for line in text.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.ids = ids
+        # id -> (start, end) of the element's contents
+        self.contents: Dict[str, Tuple[int, int]] = {}
+        # (start, end) of the <html> start tag
+        self.html_tag: Optional[Tuple[int, int]] = None
+        self.title: Optional[Tuple[int, int]] = None
+        self.head_end: Optional[int] = None
+        # language code -> end of the <option> start tag (without the ">") in the language chooser
+        self.options: Dict[str, int] = {}
+        # (tag name, id, start of the contents) of the open elements
+        self.stack: List[Tuple[str, str, int]] = []
+        self.feed(text)
+        self.close()
+
+    def get_offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        start = self.get_offset()
+        end = start + len(self.get_starttag_text())
+        attrs = dict(attrs)
+        if tag == "html":
+            self.html_tag = (start, end)
+        elif tag == "option" and any(id == LANGUAGE_CHOOSER_ID for _, id, _ in self.stack):
+            self.options[attrs.get("value") or ""] = end - 1
+        if tag not in VOID_ELEMENTS:
+            self.stack.append((tag, attrs.get("id") or "", end))
+
+    def handle_endtag(self, tag):
+        end = self.get_offset()
+        if tag == "head":
+            self.head_end = end
+        # Be tolerant of elements that were not closed
+        while self.stack:
+            open_tag, id, start = self.stack.pop()
+            if id in self.ids and id not in self.contents:
+                self.contents[id] = (start, end)
+            if open_tag == "title" and self.title is None:
+                self.title = (start, end)
+            if open_tag == tag:
+                break
+
+
+def set_html_lang(html_start_tag: str, lang: str) -> str:
+    tag = LANG_ATTRIBUTE_PATTERN.sub("", html_start_tag)
+    return f'{tag[:-1].rstrip()} lang="{lang}" {PAGE_LANG_ATTRIBUTE}="{lang}">'
+
+
+def get_alternate_links(languages: List[str]) -> str:
+    links = [f'<link rel="alternate" hreflang="{lang}" href="{get_page_name(lang)}">' for lang in languages]
+    links.append(f'<link rel="alternate" hreflang="x-default" href="{TEMPLATE_PAGE}">')
+    return "".join(links)
+
+
+def render_page(text: str, structure: PageStructure, lang: str, translations: dict, languages: List[str]) -> str:
+    # (start, end, replacement)
+    edits: List[Tuple[int, int, str]] = []
+    for id, (start, end) in structure.contents.items():
+        edits.append((start, end, get_translation(translations[id], lang)))
+    if structure.title and TITLE_ID in translations:
+        # The title can not contain tags
+        title = re.sub(r"<[^>]*>", "", get_translation(translations[TITLE_ID], lang))
+        edits.append((structure.title[0], structure.title[1], html.escape(html.unescape(title), quote=False)))
+    if structure.html_tag:
+        start, end = structure.html_tag
+        edits.append((start, end, set_html_lang(text[start:end], lang)))
+    if lang in structure.options:
+        position = structure.options[lang]
+        edits.append((position, position, " selected"))
+    if structure.head_end is not None:
+        edits.append((structure.head_end, structure.head_end, get_alternate_links(languages)))
+
+    return apply_edits(text, edits)
+
+
+def apply_edits(text: str, edits: List[Tuple[int, int, str]]) -> str:
+    # Translated elements may contain each other. Only the outer one is replaced then
+    kept_edits: List[Tuple[int, int, str]] = []
+    last_end = 0
+    for edit in sorted(edits, key=lambda edit: (edit[0], edit[0] != edit[1], -edit[1])):
+        if edit[0] >= last_end:
+            kept_edits.append(edit)
+            last_end = edit[1]
+
+    new_text = text
+    for start, end, replacement in reversed(kept_edits):
+        new_text = new_text[:start] + replacement + new_text[end:]
+    return new_text
+
+
+def main():
+    i18n_config = load_resolved_config()
+    translations = i18n_config.get("translations", {})
+    languages = i18n_config.get("translation_languages", [])
+    template_path = os.path.join(PUBLIC_DIR, TEMPLATE_PAGE)
+    text = read_file_bytes(template_path).decode(CODEC)
+    structure = PageStructure(text, list(translations))
+
+    missing_ids = [id for id in translations if id not in structure.contents]
+    if missing_ids:
+        print(f"Not in {TEMPLATE_PAGE} (only translated at runtime): {', '.join(sorted(missing_ids))}")
+
+    for lang in languages:
+        page = render_page(text, structure, lang, translations, languages)
+        page_name = get_page_name(lang)
+        if page_name != TEMPLATE_PAGE:
+            page = page.replace(PUBLIC_URL_PREFIX, "")
+        print(f"Prerendered {page_name} ({lang})")
+        write_file_bytes(os.path.join(PUBLIC_DIR, page_name), page.encode(CODEC))
+
+    if DEFAULT_LANG not in languages and structure.head_end is not None:
+        # index.html is not one of the language pages, but should still link to them
+        edits = [(structure.head_end, structure.head_end, get_alternate_links(languages))]
+        write_file_bytes(template_path, apply_edits(text, edits).encode(CODEC))
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py. Does nothing, if the i18n plugin did not run or prerendering is disabled
+    if os.path.isfile(RESOLVED_CONFIG_PATH) and load_resolved_config().get(PRERENDER_FIELD, False):
+        main()
+
+
+if __name__ == "__main__":
+    main()
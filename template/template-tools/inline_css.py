@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# ================== inline_css.py =====================
+# Removes render-blocking requests from the HTML files:
+#  - small local stylesheets are inlined (<link rel=stylesheet> -> <style>). Their url()s are rewritten, since
+#    they are now relative to the page. Stylesheets that no page links to anymore are deleted
+#  - local scripts get the "defer" attribute
+#  - preload hints are added for the deferred scripts and the images used by the inlined CSS
+# Hook type: post_build (after minify, before fingerprint)
+# Configuration: disabled by default, enable it with "template-tools/defaults.py <PROJECT> --inline_css".
+#  Options: [dir] (default: the current working dir) -b <CSS budget in bytes>
+
+import argparse
+import os
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+CODEC = "utf-8"
+PUBLIC_URL_PREFIX = "%PUBLIC_URL%/"
+# The first response should fit in the initial TCP congestion window (about 14 KB)
+DEFAULT_BUDGET = 10 * 1024
+CSS_URL_PATTERN = re.compile(r"""(url\(\s*["']?)([^"')?#]+)""")
+
+
+class Tag(NamedTuple):
+    name: str
+    attrs: Dict[str, Optional[str]]
+    start: int
+    end: int
+    in_head: bool
+
+
+class TagCollector(HTMLParser):
+    # Collects the start tags together with their position in the text
+    def __init__(self, text: str):
+        super().__init__(convert_charrefs=True)
+        self.line_offsets = [0]
+        for line in text.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.tags: List[Tag] = []
+        self.in_head = False
+        self.feed(text)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "head":
+            self.in_head = True
+        elif tag == "body":
+            self.in_head = False
+        line, column = self.getpos()
+        start = self.line_offsets[line - 1] + column
+        end = start + len(self.get_starttag_text())
+        self.tags.append(Tag(tag, dict(attrs), start, end, self.in_head))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+
+
+class Stats(NamedTuple):
+    blocking_requests: int
+    requests: int
+    size: int
+
+
+def get_local_path(dir_path: str, url: Optional[str]) -> str:
+    if not url:
+        return ""
+    if url.startswith(PUBLIC_URL_PREFIX):
+        url = url[len(PUBLIC_URL_PREFIX):]
+    elif url.startswith("/") or "://" in url or url.startswith("data:"):
+        return ""
+    path = os.path.join(dir_path, url.split("?")[0].split("#")[0])
+    return path if os.path.isfile(path) else ""
+
+
+def is_stylesheet(tag: Tag) -> bool:
+    return tag.name == "link" and (tag.attrs.get("rel") or "").lower() == "stylesheet"
+
+
+def is_blocking_script(tag: Tag) -> bool:
+    if tag.name != "script" or not tag.attrs.get("src"):
+        return False
+    return "defer" not in tag.attrs and "async" not in tag.attrs and tag.attrs.get("type") != "module"
+
+
+def get_stats(text: str) -> Stats:
+    blocking = requests = 0
+    for tag in TagCollector(text).tags:
+        if is_stylesheet(tag) or (tag.name == "script" and tag.attrs.get("src")):
+            requests += 1
+            if is_stylesheet(tag) or (tag.in_head and is_blocking_script(tag)):
+                blocking += 1
+    return Stats(blocking, requests, len(text.encode(CODEC)))
+
+
+def read_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode(CODEC)
+
+
+def write_file(path: str, content: str):
+    # write to a new file, since the old one may be a hard link to the template
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(content.encode(CODEC))
+    os.replace(tmp_path, path)
+
+
+def get_linked_stylesheets(html_path: str) -> Set[str]:
+    dir_path = os.path.dirname(html_path)
+    tags = TagCollector(read_file(html_path)).tags
+    return {os.path.normpath(get_local_path(dir_path, tag.attrs.get("href"))) for tag in tags
+            if is_stylesheet(tag) and get_local_path(dir_path, tag.attrs.get("href"))}
+
+
+def rewrite_css_urls(css: str, css_path: str, html_text: str, dir_path: str) -> Tuple[str, List[str]]:
+    # Makes the local url()s of the stylesheet work inside the page.
+    # Returns the new CSS and the rewritten URLs (the ones that may need a preload hint)
+    css_url_base = os.path.relpath(os.path.dirname(css_path), dir_path)
+    hrefs = []
+
+    def replace_url(match: re.Match) -> str:
+        url = match.group(2).strip()
+        if not get_local_path(os.path.dirname(css_path), url):
+            return match.group(0)
+        href = os.path.normpath(os.path.join(css_url_base, url))
+        if PUBLIC_URL_PREFIX in html_text:
+            # Pages processed by create-react-app use absolute URLs, so they also work on deep routes
+            href = PUBLIC_URL_PREFIX + href
+        hrefs.append(href)
+        return match.group(1) + href
+
+    return CSS_URL_PATTERN.sub(replace_url, css), hrefs
+
+
+def process_html(html_path: str, budget: int) -> Tuple[str, str, List[str]]:
+    # Returns the old and new contents of the file and the paths of the inlined stylesheets
+    dir_path = os.path.dirname(html_path)
+    text = read_file(html_path)
+    tags = TagCollector(text).tags
+    # (start, end, replacement)
+    edits: List[Tuple[int, int, str]] = []
+    preload_hints: List[str] = []
+    inlined_paths: List[str] = []
+    remaining_budget = budget
+
+    for tag in tags:
+        if is_stylesheet(tag):
+            css_path = get_local_path(dir_path, tag.attrs.get("href"))
+            if not css_path:
+                continue
+            css = read_file(css_path).strip()
+            size = len(css.encode(CODEC))
+            if size > remaining_budget or "</style" in css.lower():
+                print(f"Not inlining {css_path} ({size} bytes, {remaining_budget} bytes left in the budget)")
+                continue
+            remaining_budget -= size
+            css, hrefs = rewrite_css_urls(css, css_path, text, dir_path)
+            edits.append((tag.start, tag.end, f"<style>{css}</style>"))
+            inlined_paths.append(os.path.normpath(css_path))
+            # The images are only found after the CSS was parsed, so tell the browser about them earlier
+            for href in hrefs:
+                preload_hints.append(f'<link rel="preload" href="{href}" as="image">')
+        elif is_blocking_script(tag) and get_local_path(dir_path, tag.attrs.get("src")):
+            tag_text = text[tag.start:tag.end]
+            edits.append((tag.start, tag.end, tag_text[:-1].rstrip("/ ") + " defer>"))
+            if not tag.in_head:
+                preload_hints.append(f'<link rel="preload" href="{tag.attrs["src"]}" as="script">')
+
+    if preload_hints:
+        # Insert them after <meta charset>, since it has to be in the first bytes of the document
+        anchor = next((tag for tag in tags if tag.name == "meta" and "charset" in tag.attrs), None)
+        anchor = anchor or next((tag for tag in tags if tag.name == "head"), None)
+        if anchor:
+            edits.append((anchor.end, anchor.end, "".join(preload_hints)))
+
+    new_text = text
+    for start, end, replacement in sorted(edits, reverse=True):
+        new_text = new_text[:start] + replacement + new_text[end:]
+    return text, new_text, inlined_paths
+
+
+def process_recursive(dir_path: str, budget: int = DEFAULT_BUDGET):
+    # Only the top level HTML files are entry points of the website
+    html_paths = [os.path.join(dir_path, name) for name in sorted(os.listdir(dir_path))
+                  if name.endswith((".html", ".htm"))]
+    inlined_paths: Set[str] = set()
+    for html_path in html_paths:
+        old_text, new_text, inlined = process_html(html_path, budget)
+        inlined_paths.update(inlined)
+        if new_text != old_text:
+            write_file(html_path, new_text)
+        before, after = get_stats(old_text), get_stats(new_text)
+        print(f"{html_path}: render-blocking requests {before.blocking_requests} -> {after.blocking_requests}, "
+              f"CSS/JS requests {before.requests} -> {after.requests}, "
+              f"HTML size {before.size} -> {after.size} bytes")
+
+    # Shipping a stylesheet that was inlined everywhere would only waste space
+    still_linked: Set[str] = set()
+    for html_path in html_paths:
+        still_linked.update(get_linked_stylesheets(html_path))
+    for css_path in sorted(inlined_paths - still_linked):
+        print(f"Removing {css_path}, since all pages contain it now")
+        os.remove(css_path)
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("dir", nargs="?", default=".", help="the folder to process (default: the current working dir)")
+    ap.add_argument("-b", "--budget", type=int, default=DEFAULT_BUDGET, help=f"maximum number of CSS bytes inlined per HTML file (default: {DEFAULT_BUDGET})")
+    args = ap.parse_args(argv)
+
+    process_recursive(args.dir, args.budget)
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py, which runs the plugin in-process
+    main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,201 @@
 #!/usr/bin/env python3
 
-# ================== i18n.py =====================
+# ================== minify.py =====================
 # Minifies HTML, CSS, and JS files
 # Hook type: post_build
 # Configuration: You need to do nothing :)
-
+# Usage: minify.py [dir] (default: the current working dir)
+#
+# Minified outputs are cached by the hash of the input, so unchanged files are never minified twice.
+# Files are minified in parallel (in multiple processes, since the minifiers are pure python).
+# JS files that are already minified (*.min.js, or files consisting of very long lines) are left as is.
+
+import hashlib
+import json
 import os
-from typing import Callable
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional
 # External dependencies
 import htmlmin
 import rcssmin
 import rjsmin
 
 CODEC = "utf-8"
-
-
-def replace_file_contents(path: str, fn: Callable[[str], str]):
-    # read
-    with open(path, "rb") as f:
-        file_contents = f.read().decode(CODEC)
-    # modify
-    file_contents = str(fn(file_contents))
-    # write
-    with open(path, "wb") as f:
-        f.write(file_contents.encode(CODEC))
+# Set by the template tool. Empty means, that caching is disabled (--no-cache)
+CACHE_DIR_ENV_VAR = "REACT_TEMPLATE_CACHE_DIR"
+# @SYNC with: ../../src/utils.py CACHE_DIR
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "react-template")
+# Bump this to invalidate all existing cache entries
+CACHE_FORMAT_VERSION = "1"
+# Only the newest entries are kept
+MAX_CACHE_ENTRIES = 2000
+# Starting worker processes takes longer than minifying a few small files
+MIN_BYTES_FOR_PARALLEL = 256 * 1024
+# Code with lines this long (on average) was minified before
+MINIFIED_LINE_LENGTH = 500
+
+
+class Minifier(NamedTuple):
+    name: str
+    version: str
+    fn: Callable[[str], str]
+    # The options passed to fn. Part of the cache key
+    options: dict
+    # Whether already minified inputs should be left as is. Not done for CSS, since the compiled
+    # SASS files are compressed already, but rcssmin still makes them a bit smaller
+    detect_minified: bool
 
 
 def minify_html(file_contents: str) -> str:
-    return htmlmin.minify(file_contents,
-                          remove_comments=True,
-                          remove_empty_space=True) + "\n"
+    return htmlmin.minify(file_contents, **MINIFIERS[".html"].options) + "\n"
 
 
 def minify_css(file_contents: str) -> str:
-    return rcssmin.cssmin(file_contents)
+    return rcssmin.cssmin(file_contents, **MINIFIERS[".css"].options)
 
 
 def minify_js(file_contents: str) -> str:
-    return rjsmin.jsmin(file_contents)
+    return rjsmin.jsmin(file_contents, **MINIFIERS[".js"].options)
 
 
-def process_file(file_path: str):
-    if file_path.endswith(".htm") or file_path.endswith(".html"):
-        print(f"Minifying {file_path}")
-        replace_file_contents(file_path, minify_html)
-    elif file_path.endswith(".css"):
-        print(f"Minifying {file_path}")
-        replace_file_contents(file_path, minify_css)
-    elif file_path.endswith(".js"):
-        print(f"Minifying {file_path}")
-        replace_file_contents(file_path, minify_js)
+HTML_MINIFIER = Minifier("htmlmin", htmlmin.__version__, minify_html,
+                         {"remove_comments": True, "remove_empty_space": True}, False)
+MINIFIERS = {
+    ".htm": HTML_MINIFIER,
+    ".html": HTML_MINIFIER,
+    ".css": Minifier("rcssmin", rcssmin.__version__, minify_css, {}, False),
+    ".js": Minifier("rjsmin", rjsmin.__version__, minify_js, {}, True),
+}
 
 
-def process_recursive(dir_path: str):
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR, DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, "minify") if cache_dir else ""
+
+
+def get_minifier(file_path: str) -> Optional[Minifier]:
+    return MINIFIERS.get(os.path.splitext(file_path)[1].lower())
+
+
+def get_cache_key(minifier: Minifier, file_contents: bytes) -> str:
+    hasher = hashlib.sha256()
+    settings = [CACHE_FORMAT_VERSION, minifier.name, minifier.version, minifier.options]
+    hasher.update(json.dumps(settings, sort_keys=True).encode(CODEC) + b"\n")
+    hasher.update(file_contents)
+    return hasher.hexdigest()
+
+
+def is_already_minified(file_path: str, file_contents: str) -> bool:
+    if ".min." in os.path.basename(file_path):
+        return True
+    # Ignore comments (like license headers), since minifiers may keep them
+    code_lines = [line for line in file_contents.splitlines()
+                  if line.strip() and not line.lstrip().startswith(("//", "/*", "*"))]
+    return bool(code_lines) and len(file_contents) / len(code_lines) >= MINIFIED_LINE_LENGTH
+
+
+def minify_contents(file_path: str, file_contents: bytes) -> bytes:
+    # Runs in a worker process
+    minifier = get_minifier(file_path)
+    return str(minifier.fn(file_contents.decode(CODEC))).encode(CODEC)
+
+
+def write_file(path: str, content: bytes):
+    # write to a new file, since the old one may be a hard link to the template
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_cached(cache_dir: str, cache_key: str) -> Optional[bytes]:
+    try:
+        return read_file(os.path.join(cache_dir, cache_key))
+    except OSError:
+        return None
+
+
+def store_cached(cache_dir: str, cache_key: str, content: bytes):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_file(os.path.join(cache_dir, cache_key), content)
+    except OSError as e:
+        print(f"[WARN] Can not write to the minify cache: {e}")
+
+
+def prune_cache(cache_dir: str):
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [entry for entry in it if entry.is_file()]
+        if len(entries) > MAX_CACHE_ENTRIES:
+            entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for entry in entries[MAX_CACHE_ENTRIES:]:
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def list_files(dir_path: str) -> List[str]:
+    file_list = []
     for root, _dirs, files in os.walk(dir_path):
         for name in files:
-            file_path = os.path.join(root, name)
-            process_file(file_path)
+            file_list.append(os.path.join(root, name))
+    return file_list
+
+
+def process_recursive(dir_path: str):
+    cache_dir = get_cache_dir()
+    # file path -> (cache key, contents) of the files that need to be minified
+    to_minify: Dict[str, tuple] = {}
+    for file_path in list_files(dir_path):
+        minifier = get_minifier(file_path)
+        if not minifier:
+            continue
+        file_contents = read_file(file_path)
+        if minifier.detect_minified and is_already_minified(file_path, file_contents.decode(CODEC)):
+            print(f"Already minified: {file_path}")
+            continue
+        cache_key = get_cache_key(minifier, file_contents)
+        cached = read_cached(cache_dir, cache_key) if cache_dir else None
+        if cached is None:
+            to_minify[file_path] = (cache_key, file_contents)
+        else:
+            print(f"Minified (cached): {file_path}")
+            if cached != file_contents:
+                write_file(file_path, cached)
+
+    if not to_minify:
+        return
+    file_paths = list(to_minify)
+    inputs = [to_minify[path][1] for path in file_paths]
+    if len(file_paths) > 1 and sum(len(x) for x in inputs) >= MIN_BYTES_FOR_PARALLEL:
+        with ProcessPoolExecutor() as executor:
+            outputs = list(executor.map(minify_contents, file_paths, inputs))
+    else:
+        outputs = [minify_contents(path, x) for path, x in zip(file_paths, inputs)]
+
+    for file_path, file_contents, output in zip(file_paths, inputs, outputs):
+        print(f"Minifying {file_path}")
+        if output != file_contents:
+            write_file(file_path, output)
+        if cache_dir:
+            store_cached(cache_dir, to_minify[file_path][0], output)
+    if cache_dir:
+        prune_cache(cache_dir)
+
+
+def run(context, args: List[str]):
+    # Called by defaults.py, which runs the plugin in-process
+    process_recursive(args[0] if args else ".")
 
 
 if __name__ == "__main__":
-    process_recursive(".")
+    process_recursive(sys.argv[1] if len(sys.argv) > 1 else ".")